@@ -1,8 +1,6 @@
 #!/usr/bin/env python
-from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError
-from genefab3.exceptions import GeneLabDatabaseException
-from genefab3.config import MONGO_DB_NAME, DEBUG_MARKERS, COMPRESSIBLE_MIMETYPES
+from genefab3.mongo.utils import get_database
+from genefab3.config import DEBUG_MARKERS, COMPRESSIBLE_MIMETYPES
 from flask import Flask, request
 from flask_compress import Compress
 from os import environ
@@ -17,16 +15,13 @@ app = Flask("genefab3")
 COMPRESS_MIMETYPES = COMPRESSIBLE_MIMETYPES
 Compress(app)
 
-mongo = MongoClient(serverSelectionTimeoutMS=2000)
-try:
-    mongo.server_info()
-except ServerSelectionTimeoutError:
-    raise GeneLabDatabaseException("Could not connect (sensitive info hidden)")
-else:
-    db = getattr(mongo, MONGO_DB_NAME)
+db = get_database()
 
-if environ.get("WERKZEUG_RUN_MAIN", None) != "true":
+if environ.get("GENEFAB3_CACHER", "app") == "standalone":
+    pass # cache is kept up to date by `python -m genefab3.cacher`
+elif environ.get("WERKZEUG_RUN_MAIN", None) != "true":
     # https://stackoverflow.com/a/9476701/590676
+    # only one CacherThread is active cluster-wide (see MongoLease)
     CacherThread(db).start()
 
 if environ.get("FLASK_ENV", None) in DEBUG_MARKERS:
@@ -64,6 +59,12 @@ def favicon(**kwargs):
 
 # Debug zone:
 
+@app.route("/debug/health/", methods=["GET"])
+def health(**kwargs):
+    """Display state of cold storage circuit breakers"""
+    from genefab3.flask.debug import get_cold_storage_health as getter
+    return displayable(db, getter, kwargs, request)
+
 @app.route("/debug/<accession>/<assay_name>/<meta>/", methods=["GET"])
 def assay_metadata(**kwargs):
     """Display assay metadata"""
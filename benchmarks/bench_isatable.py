@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+from benchmarks.fixtures import wide_isa_table_json
+from genefab3.isa.types import ISATable
+from genefab3.exceptions import GeneLabJSONException
+from pandas import DataFrame, concat, __version__ as pandas_version
+from argparse import ArgumentParser
+from timeit import repeat
+
+
+def ISATable_via_transposes(entries):
+    """Previous implementation of ISATable (before single-allocation rewrite), kept for reference"""
+    try:
+        raw_header = DataFrame(entries["header"])
+        raw_values = DataFrame(entries["raw"])
+    except (KeyError, TypeError):
+        raise GeneLabJSONException("Malformed ISA JSON table passed")
+    if raw_header["encoded"].any():
+        raise GeneLabJSONException("Encoded fields are not supported")
+    else:
+        return (
+            concat([
+                raw_header[["field", "title"]].set_index("field").T,
+                raw_values
+            ])
+            .T.reset_index()
+            .set_index(["title", "index"]).T
+        )
+
+
+def best_of(function, entries, number, repeats):
+    """Time `function(entries)`, report best average in milliseconds"""
+    timings = repeat(lambda: function(entries), number=number, repeat=repeats)
+    return min(timings) / number * 1000
+
+
+def main():
+    """Compare ISATable against previous implementation on synthetic table"""
+    parser = ArgumentParser(description=main.__doc__)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--columns", type=int, default=301)
+    parser.add_argument("--number", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    entries = wide_isa_table_json(args.rows, args.columns)
+    current, previous = ISATable(entries), ISATable_via_transposes(entries)
+    previous = previous.reset_index(drop=True)
+    if not current.equals(previous.astype(object)):
+        raise AssertionError("Implementations disagree")
+    print("pandas {}, {} x {} table".format(
+        pandas_version, args.rows, args.columns,
+    ))
+    for name, function in [
+            ("via transposes", ISATable_via_transposes),
+            ("single allocation", ISATable),
+        ]:
+        print("{:>20}: {:8.2f} ms".format(
+            name, best_of(function, entries, args.number, args.repeat),
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+from benchmarks.fixtures import glds_json, visualization_table
+import genefab3.mongo.data
+import genefab3.coldstorage.assay
+from genefab3.mongo.data import query_data
+from genefab3.coldstorage.dataset import ColdStorageDataset
+from genefab3.caching import FileCache
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from threading import Thread
+from tempfile import TemporaryDirectory
+from argparse import ArgumentParser
+from os import path, makedirs
+from time import sleep, time
+
+
+VIZ_FILENAME_MASK = "{}_rna_seq_visualization_output_table.csv"
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """Serves synthetic cold storage files concurrently"""
+    daemon_threads = True
+
+
+class SlowRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files from `root`, delaying those of the first dataset by `delay` seconds"""
+    root, delay = None, 0
+ 
+    def translate_path(self, url_path):
+        """Map URL to file in `root`"""
+        return path.join(self.root, path.basename(url_path))
+ 
+    def do_GET(self):
+        """Delay response for the first dataset, then serve file"""
+        if self.path.endswith(VIZ_FILENAME_MASK.format("GLDS-1")):
+            sleep(self.delay)
+        return super().do_GET()
+ 
+    def log_message(self, *args):
+        """Keep benchmark output clean"""
+        pass
+
+
+def make_datasets(root, url, n_datasets, n_assays, n_samples, n_genes):
+    """Store processed tables of synthetic multi-assay datasets in `root`; last dataset has no processed table"""
+    datasets, sample_columns = {}, []
+    for k in range(1, n_datasets+1):
+        accession = "GLDS-{}".format(k)
+        assay_names = [
+            "a_{}_rna_seq_{}".format(accession, i) for i in range(n_assays)
+        ]
+        fileurls, filedates = {}, {}
+        if k < n_datasets:
+            filename = VIZ_FILENAME_MASK.format(accession)
+            sample_names = ["Sample_{}".format(j) for j in range(n_samples)]
+            visualization_table(n_genes, sample_names, seed=k).to_csv(
+                path.join(root, filename),
+            )
+            fileurls[filename] = "{}/{}".format(url, filename)
+            filedates[filename] = 1
+        datasets[accession] = ColdStorageDataset(
+            accession, glds_json(accession, assay_names, n_samples, seed=k),
+            fileurls=fileurls, filedates=filedates,
+        )
+        sample_columns.extend(
+            (accession, assay_name, "Sample_{}".format(j))
+            for assay_name in assay_names for j in range(0, n_samples, 2)
+        )
+    return datasets, sample_columns
+
+
+def main():
+    """Time /data/ queries over synthetic multi-assay datasets served by local HTTP server, with cold and warm columnar cache"""
+    parser = ArgumentParser(description=main.__doc__)
+    parser.add_argument("--datasets", type=int, default=5)
+    parser.add_argument("--assays", type=int, default=2)
+    parser.add_argument("--samples", type=int, default=100)
+    parser.add_argument("--genes", type=int, default=20000)
+    parser.add_argument("--delay", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    with TemporaryDirectory() as tempdir:
+        root, cache = path.join(tempdir, "www"), path.join(tempdir, "cache")
+        makedirs(root)
+        SlowRequestHandler.root, SlowRequestHandler.delay = root, args.delay
+        server = ThreadingHTTPServer(("127.0.0.1", 0), SlowRequestHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        datasets, sample_columns = make_datasets(
+            root, "http://127.0.0.1:{}".format(server.server_port),
+            args.datasets, args.assays, args.samples, args.genes,
+        )
+        # datasets are served from memory instead of MongoDB and cold storage:
+        genefab3.mongo.data.get_dataset_with_caching = (
+            lambda db, accession, on_demand=False: datasets[accession]
+        )
+        genefab3.coldstorage.assay.FILE_CACHE = FileCache(cache, 1 << 40)
+        print("{} datasets x {} assays, {} genes, {} of {} samples".format(
+            args.datasets, args.assays, args.genes,
+            len(sample_columns) // (args.datasets * args.assays), args.samples,
+        ))
+        for label in ["cold cache"] + ["warm cache"] * args.repeat:
+            start = time()
+            sample_data = query_data(None, sample_columns)
+            print("{:>12}: {:8.3f} s, {} x {}, {} warning(s)".format(
+                label, time() - start, *sample_data.shape,
+                len(sample_data.attrs["warnings"]),
+            ))
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+from random import Random
+from numpy.random import RandomState
+from pandas import DataFrame
+
+
+SAMPLE_COLUMNS = [
+    "Source Name", "Sample Name", "Characteristics: Organism",
+    "Characteristics: Strain", "Factor Value: Spaceflight", "Factor Value: Age",
+    "Comment: Note", "Parameter Value: Temperature", "Term Source REF",
+    "Protocol REF",
+]
+ASSAY_COLUMNS = [
+    "Sample Name", "Protocol REF", "Parameter Value: Library Layout",
+    "Raw Data File", "Derived Data File",
+]
+
+
+def isa_table_json(titles, n_rows, seed=0, sample_prefix="Sample_", untitled=1):
+    """Generate 'header' and 'raw' fields of ISA table like those in GLDS JSONs, with `untitled` raw fields missing from header"""
+    random = Random(seed)
+    header = [
+        {
+            "field": "a{}{}".format(i, t.replace(" ", "")), "title": t,
+            "encoded": False,
+        }
+        for i, t in enumerate(titles)
+    ]
+    raw = []
+    for j in range(n_rows):
+        row = {}
+        for h in header:
+            if h["title"] == "Sample Name":
+                row[h["field"]] = "{}{}".format(sample_prefix, j)
+            elif h["title"].endswith("File"):
+                row[h["field"]] = "s{}.fastq.gz".format(j)
+            else:
+                row[h["field"]] = "v{}".format(random.randint(0, 3))
+        for k in range(untitled):
+            row["untitled{}".format(k)] = "u{}".format(random.randint(0, 3))
+        raw.append(row)
+    return {"header": header, "raw": raw}
+
+
+def wide_isa_table_json(n_rows, n_columns, seed=0):
+    """Generate ISA table with `n_columns` columns (Sample Name first, then repeated sample columns)"""
+    titles = ["Sample Name"] + [
+        "{} {}".format(SAMPLE_COLUMNS[i % len(SAMPLE_COLUMNS)], i)
+        for i in range(1, n_columns)
+    ]
+    return isa_table_json(titles, n_rows, seed)
+
+
+def glds_json(accession, assay_names, n_samples, seed=0):
+    """Generate GLDS JSON of dataset with assays `assay_names`, each with its own samples table of `n_samples` samples"""
+    assays, samples = {}, {}
+    for i, assay_name in enumerate(assay_names):
+        assays[assay_name] = isa_table_json(ASSAY_COLUMNS, n_samples, seed+i)
+        samples["s" + assay_name[1:]] = isa_table_json(
+            SAMPLE_COLUMNS, n_samples, seed+i,
+        )
+    return [{
+        "accession": accession, "legacy_accession": accession,
+        "_id": "id-" + accession, "doiFields": [{"doi": "10.0/" + accession}],
+        "foreignFields": [{"isa2json": {"additionalInformation": {
+            "assays": assays, "samples": samples,
+        }}}],
+    }]
+
+
+def visualization_table(n_genes, sample_names, seed=0):
+    """Generate processed table like *_visualization_output_table.csv: gene IDs, symbols (some missing), values of samples"""
+    random = RandomState(seed)
+    table = DataFrame(
+        random.random_sample((n_genes, len(sample_names))),
+        columns=sample_names,
+        index=["ENSG{:011d}".format(i) for i in range(n_genes)],
+    )
+    table.insert(0, "SYMBOL", [
+        "gene{}".format(i) if i % 10 else None for i in range(n_genes)
+    ])
+    return table
@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+from genefab3.mongo.utils import get_database
+from genefab3.mongo.meta import CacherThread
+
+
+def main():
+    """Keep local metadata cache up to date outside of web workers"""
+    cacher_thread = CacherThread(get_database())
+    cacher_thread.start()
+    cacher_thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+from collections import OrderedDict
+from threading import Lock
+from os import path, makedirs, listdir, remove, replace, rename, utime, stat
+from os import walk, fstat, close, open as os_open, O_RDONLY
+from fcntl import flock, LOCK_SH, LOCK_EX, LOCK_NB
+from shutil import rmtree
+from contextlib import contextmanager
+from hashlib import sha256
+from tempfile import NamedTemporaryFile, mkdtemp
+
+
+class LRUCache():
+    """Thread-safe LRU cache of versioned values, bounded by number of entries and by their total estimated size"""
+ 
+    def __init__(self, max_entries, max_bytes, sizeof):
+        """Initialize empty cache; `sizeof` estimates size of a value in bytes"""
+        self.max_entries, self.max_bytes, self.sizeof = (
+            max_entries, max_bytes, sizeof, # max_bytes=None: no size bound
+        )
+        self.entries, self.lock = OrderedDict(), Lock()
+        self.nbytes, self.hits, self.misses = 0, 0, 0
+ 
+    def get(self, key, version=None):
+        """Get value stored under `key` if stored with same `version`, otherwise None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if (entry is None) or (entry[0] != version):
+                self.misses += 1
+                return None
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                nbytes = self.sizeof(entry[1]) # values may grow after put()
+                self.entries[key] = (entry[0], entry[1], nbytes)
+                self.nbytes += nbytes - entry[2]
+                self.evict()
+                return entry[1]
+ 
+    def put(self, key, value, version=None):
+        """Store value under `key` (replacing other versions), evict least recently used values if over limits"""
+        nbytes = self.sizeof(value)
+        with self.lock:
+            self.pop(key)
+            if (self.max_bytes is None) or (nbytes <= self.max_bytes):
+                self.entries[key] = (version, value, nbytes)
+                self.nbytes += nbytes
+            self.evict()
+ 
+    def evict(self):
+        """Remove least recently used values while over limits (caller holds lock)"""
+        while (len(self.entries) > self.max_entries) or (
+                (self.max_bytes is not None) and (self.nbytes > self.max_bytes)
+            ):
+            self.pop(next(iter(self.entries)))
+ 
+    def pop(self, key):
+        """Remove value stored under `key`, if any (caller holds lock)"""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+ 
+    def stats(self):
+        """Report size and efficiency of cache"""
+        with self.lock:
+            return {
+                "entries": len(self.entries), "bytes": self.nbytes,
+                "hits": self.hits, "misses": self.misses,
+            }
+
+
+class FileCache():
+    """Thread- and process-safe on-disk LRU cache of downloaded files (or directories), bounded by size"""
+ 
+    def __init__(self, root, max_bytes):
+        """Initialize cache in directory `root` (created on first write)"""
+        self.root, self.max_bytes = root, max_bytes
+        self.locks, self.locks_lock = {}, Lock()
+ 
+    def lock(self, url):
+        """Get lock serializing downloads of `url` within process"""
+        with self.locks_lock:
+            if url not in self.locks:
+                self.locks[url] = Lock()
+            return self.locks[url]
+ 
+    def filename(self, url, timestamp):
+        """Name cached entry after hash of URL and file timestamp"""
+        return "{}-{}".format(sha256(url.encode()).hexdigest(), timestamp)
+ 
+    def fetch(self, url, timestamp, store, isdir=False):
+        """Get path to cached entry, creating it with `store(url, temp)` if missing or outdated"""
+        filename = self.filename(url, timestamp)
+        entrypath = path.join(self.root, filename)
+        with self.lock(url):
+            try:
+                utime(entrypath) # mark as recently used
+            except FileNotFoundError: # not cached yet, or evicted
+                pass
+            else:
+                return entrypath
+            makedirs(self.root, exist_ok=True)
+            # `temp` is open binary file, or directory path if `isdir`:
+            if isdir:
+                temp = mkdtemp(dir=self.root, prefix=".")
+                try:
+                    store(url, temp)
+                    rename(temp, entrypath) # readers never see partial entries
+                except BaseException:
+                    rmtree(temp, ignore_errors=True)
+                    if not path.isdir(entrypath): # not stored by other process
+                        raise
+            else:
+                with NamedTemporaryFile(
+                        mode="wb", dir=self.root, prefix=".", delete=False,
+                    ) as temp:
+                    try:
+                        store(url, temp)
+                    except BaseException:
+                        remove(temp.name)
+                        raise
+                replace(temp.name, entrypath)
+            self.evict(keep=filename)
+        return entrypath
+ 
+    @contextmanager
+    def pinned(self, url, timestamp, store, isdir=False):
+        """Fetch entry like fetch() does, and keep it from being evicted while in context"""
+        while True:
+            entrypath = self.fetch(url, timestamp, store, isdir)
+            try:
+                fd = os_open(entrypath, O_RDONLY)
+            except FileNotFoundError: # evicted before it could be pinned
+                continue
+            try:
+                flock(fd, LOCK_SH) # waits for eviction in progress, if any
+                if self.is_locked_entry(fd, entrypath):
+                    yield entrypath
+                    return
+            finally:
+                close(fd) # releases lock
+ 
+    def open(self, url, timestamp, download):
+        """Open cached copy of file for reading, downloading it first if missing or outdated"""
+        with self.pinned(url, timestamp, download) as entrypath:
+            return open(entrypath, mode="rb") # stays valid after removal
+ 
+    def sizeof(self, entrypath):
+        """Get size of cached file or directory in bytes"""
+        if path.isdir(entrypath):
+            return sum(
+                stat(path.join(dirpath, filename)).st_size
+                for dirpath, _, filenames in walk(entrypath)
+                for filename in filenames
+            )
+        else:
+            return stat(entrypath).st_size
+ 
+    def is_locked_entry(self, fd, entrypath):
+        """Check if locked descriptor `fd` still refers to entry at `entrypath` (i.e., entry has not been removed or replaced)"""
+        try:
+            return path.samestat(fstat(fd), stat(entrypath))
+        except FileNotFoundError:
+            return False
+ 
+    def discard(self, entrypath):
+        """Remove cached file or directory unless it is pinned by readers (see pinned()); return False if pinned"""
+        try:
+            fd = os_open(entrypath, O_RDONLY)
+        except FileNotFoundError: # removed by another process
+            return True
+        try:
+            try:
+                flock(fd, LOCK_EX | LOCK_NB)
+            except BlockingIOError:
+                return False
+            if not self.is_locked_entry(fd, entrypath):
+                return True # removed (and maybe replaced) by another process
+            elif path.isdir(entrypath):
+                rmtree(entrypath, ignore_errors=True)
+            else:
+                try:
+                    remove(entrypath)
+                except FileNotFoundError: # removed by another process
+                    pass
+            return True
+        finally:
+            close(fd)
+ 
+    def evict(self, keep):
+        """Remove outdated versions of entries and least recently used entries until cache fits into `max_bytes`"""
+        prefix = keep.rsplit("-", 1)[0] + "-"
+        entries = []
+        for filename in listdir(self.root):
+            if filename.startswith(".") or (filename == keep):
+                continue
+            entrypath = path.join(self.root, filename)
+            if filename.startswith(prefix):
+                self.discard(entrypath)
+            else:
+                try:
+                    entries.append((
+                        stat(entrypath).st_mtime, self.sizeof(entrypath),
+                        entrypath,
+                    ))
+                except FileNotFoundError: # removed by another process
+                    continue
+        nbytes = sum(size for _, size, _ in entries) + self.sizeof(
+            path.join(self.root, keep),
+        )
+        for _, size, entrypath in sorted(entries):
+            if nbytes <= self.max_bytes:
+                break
+            elif self.discard(entrypath):
+                nbytes -= size
@@ -1,10 +1,19 @@
 from genefab3.exceptions import GeneLabJSONException, GeneLabException
-from genefab3.config import INDEX_BY, ASSAY_TYPES
+from genefab3.config import INDEX_BY, ASSAY_TYPES, ISA_COLUMN_CATEGORIES
+from genefab3.config import FILE_CACHE_DIR, FILE_CACHE_MAX_BYTES
+from genefab3.config import GENE_SYMBOL_COLUMNS, FILE_LOOKUP_CACHE_MAX_ENTRIES
 from genefab3.utils import force_default_name_delimiter
+from genefab3.caching import FileCache, LRUCache
+from genefab3.coldstorage.client import COLD_STORAGE_CLIENT
+from genefab3.coldstorage.columnar import write_columnar, ColumnarTable
+from genefab3.coldstorage.columnar import COLUMNAR_FORMAT
 from pandas import DataFrame, read_csv, isnull, MultiIndex, concat
 from re import compile, search, split, sub, IGNORECASE
 from copy import copy
-from urllib.request import urlopen
+from contextlib import contextmanager
+from sys import getsizeof
+from shutil import copyfileobj
+from tempfile import TemporaryFile
 from itertools import count
 from numpy import vstack
 
@@ -29,20 +38,23 @@ def filter_table(isa_table, use=None, discard=None, index_by=INDEX_BY):
     return filtered_table
 
 
-def strip_prefixes(dataframe, use):
-    """Remove prefixes used to filter original table"""
-    expression = r'^{}:\s*'.format(use)
+def strip_prefixes(dataframe, use, stripped=None):
+    """Remove prefixes used to filter original table (or rename to precomputed `stripped` names)"""
+    if stripped is None:
+        expression = r'^{}:\s*'.format(use)
+        strip = lambda l0: sub(expression, "", l0, flags=IGNORECASE)
+    else:
+        strip = lambda l0: stripped.get(l0, l0)
     return DataFrame(
         data=dataframe.values,
         index=dataframe.index,
         columns=MultiIndex.from_tuples([
-            (sub(expression, "", l0, flags=IGNORECASE), l1)
-            for l0, l1 in dataframe.columns
+            (strip(l0), l1) for l0, l1 in dataframe.columns
         ]),
     )
 
 
-def make_metadatalike_dataframe(isa_table, index_by=INDEX_BY, use=None):
+def make_metadatalike_dataframe(isa_table, index_by=INDEX_BY, use=None, stripped=None):
     """Index dataframe by index_by"""
     index_columns = isa_table[index_by]
     if index_columns.shape[1] == 0:
@@ -62,7 +74,7 @@ def make_metadatalike_dataframe(isa_table, index_by=INDEX_BY, use=None):
     index = (index_by, index_columns.columns[0])
     full = isa_table.loc[:,keep].set_index(index)
     if (full.shape[1] > 0) and use:
-        full = strip_prefixes(full, use)
+        full = strip_prefixes(full, use, stripped)
     full.index.name, full.columns.names = None, index
     return full
 
@@ -96,15 +108,107 @@ def ISATableLike(data, like):
     ], axis=1)
 
 
+def harmonize_field(field):
+    """Lowercase field title and replace underscores with spaces"""
+    return sub(r'_', " ", field).lower()
+
+
+class ClassifiedISATable():
+    """Stores ISATable with columns partitioned by prefix in a single pass"""
+ 
+    def __init__(self, isa_table, index_by=INDEX_BY, harmonize=harmonize_field, categories=ISA_COLUMN_CATEGORIES):
+        """Classify columns as one of `categories` or as 'other', precompute harmonized and stripped titles"""
+        self.isa_table = isa_table
+        self.index_by = harmonize(index_by)
+        matches = compile(
+            r'^({}):\s*'.format("|".join(categories)), flags=IGNORECASE,
+        ).search
+        self.categories, self.harmonized, self.stripped = [], [], {}
+        for l0, _ in isa_table.columns:
+            if isnull(l0):
+                category, harmonized = None, l0
+            else:
+                match, harmonized = matches(l0), harmonize(l0)
+                if l0 == index_by:
+                    category = "index"
+                elif match:
+                    category = match.group(1).lower()
+                    self.stripped.setdefault(category, {})[harmonized] = sub(
+                        r'^{}:\s*'.format(category), "", harmonized,
+                        flags=IGNORECASE,
+                    )
+                else:
+                    category = "other"
+            self.categories.append(category)
+            self.harmonized.append(harmonized)
+        self.nbytes = (
+            getsizeof(self.categories) + getsizeof(self.harmonized) +
+            sum(getsizeof(h) for h in self.harmonized) + sum(
+                getsizeof(stripped) + sum(map(getsizeof, stripped.values()))
+                for stripped in self.stripped.values()
+            )
+        )
+ 
+    def memory_usage(self):
+        """Estimate memory footprint of classification (ISATable itself is counted by dataset) in bytes"""
+        return self.nbytes
+ 
+    def select(self, use=None, discard=None):
+        """Get harmonized subtable of index columns and columns in category `use` XOR not in categories `discard`"""
+        if use:
+            selected = lambda category: category == use
+        elif discard:
+            selected = lambda category: category not in discard
+        else:
+            selected = lambda category: True
+        positions = [
+            i for i, category in enumerate(self.categories)
+            if (category is not None)
+            and ((category == "index") or selected(category))
+        ]
+        subtable = self.isa_table.iloc[:,positions].copy()
+        subtable.columns = MultiIndex.from_tuples([
+            (self.harmonized[i], l1)
+            for i, (_, l1) in zip(positions, subtable.columns)
+        ])
+        return subtable, self.stripped.get(use, {})
+
+
 class MetadataLike():
     """Stores assay fields and metadata in raw and processed form"""
  
-    def __init__(self, data, like=None, use=None, discard=None, index_by=INDEX_BY, harmonize=lambda f: sub(r'_', " ", f).lower()):
-        """Convert assay ISATable to metadata object, or make metadata object similar to `like`"""
+    def __init__(self, data, like=None, use=None, discard=None, index_by=INDEX_BY, harmonize=harmonize_field):
+        """Convert assay ISATable (raw or classified) to metadata object, or make metadata object similar to `like`"""
+        if isinstance(data, ClassifiedISATable):
+            isa_table, stripped = data.select(use=use, discard=discard)
+            index_by = data.index_by
+        else:
+            isa_table, stripped = self.filter_and_harmonize(
+                data, like, use, discard, index_by, harmonize,
+            )
+            index_by = harmonize(index_by) if harmonize else index_by
+        self.full = make_metadatalike_dataframe(
+            isa_table, index_by, use, stripped,
+        )
+        self.named = make_named_metadatalike_dataframe(self.full, index_by)
+        self.indexed_by = index_by
+        self.nbytes = None
+ 
+    def memory_usage(self):
+        """Estimate memory footprint of raw and processed dataframes in bytes"""
+        if self.nbytes is None: # dataframes do not change once built
+            self.nbytes = sum(
+                int(dataframe.memory_usage(deep=True).sum())
+                for dataframe in (self.full, self.named)
+            )
+        return self.nbytes
+ 
+    def filter_and_harmonize(self, data, like, use, discard, index_by, harmonize):
+        """Reduce and harmonize columns of unclassified ISATable"""
         if isinstance(data, dict) and isinstance(like, MetadataLike):
             isa_table = ISATableLike(data, like)
         elif isinstance(data, DataFrame):
-            isa_table = data
+            isa_table = data.copy(deep=False) # harmonize without touching ISA
         else:
             raise GeneLabException("MetadataLike from unsupported object type")
         if use:
@@ -122,10 +226,7 @@ class MetadataLike():
                 (l0, l1) if isnull(l0) else (harmonize(l0), l1)
                 for l0, l1 in isa_table.columns
             ])
-            index_by = harmonize(index_by)
-        self.full = make_metadatalike_dataframe(isa_table, index_by, use)
-        self.named = make_named_metadatalike_dataframe(self.full, index_by)
-        self.indexed_by = index_by
+        return isa_table, None
 
 
 def INPLACE_force_default_name_delimiter_in_file_data(filedata, metadata_indexed_by, metadata_name_set):
@@ -154,35 +255,115 @@ def infer_assay_types(assay_name):
     }
 
 
+def lazy_metadatalike(attribute):
+    """Make property that builds MetadataLike on first access and memoizes it in assay"""
+    def getter(self):
+        if attribute not in self.metadatalikes:
+            self.metadatalikes[attribute] = self.make_metadatalike(attribute)
+        return self.metadatalikes[attribute]
+    return property(getter)
+
+
+FILE_CACHE = FileCache(FILE_CACHE_DIR, FILE_CACHE_MAX_BYTES)
+COLUMNAR_KEY_MASK = "columnar{}:sep={}:{}"
+COMPRESSION_EXTENSIONS = {
+    ".gz": "gzip", ".bz2": "bz2", ".zip": "zip", ".xz": "xz",
+}
+
+
+def download_file(url, handle):
+    """Stream file at `url` into open binary `handle`"""
+    with COLD_STORAGE_CLIENT.open(url) as response:
+        copyfileobj(response, handle)
+
+
+@contextmanager
+def download_to_temporary_file(url):
+    """Download file at `url` to anonymous temporary file and yield it open for reading"""
+    with TemporaryFile() as handle:
+        download_file(url, handle) # frees connection before parsing
+        handle.seek(0)
+        yield handle
+
+
+def infer_compression(filename):
+    """Infer compression from file extension, like read_csv() does for paths"""
+    for extension, compression in COMPRESSION_EXTENSIONS.items():
+        if filename.endswith(extension):
+            return compression
+    else:
+        return None
+
+
+def open_file(fileinfo):
+    """Open file from local cache, downloading it if missing or outdated; stream directly if file has no known timestamp"""
+    if fileinfo.timestamp < 0:
+        return COLD_STORAGE_CLIENT.open(fileinfo.url)
+    else:
+        return FILE_CACHE.open(fileinfo.url, fileinfo.timestamp, download_file)
+
+
 class ColdStorageAssay():
     """Stores individual assay information and metadata"""
  
     def __init__(self, dataset, name, sample_key):
-        """Parse assay-related entries from ISA"""
-        try:
-            _ = dataset.assays[name]
-        except (AttributeError, KeyError):
+        """Associate assay with dataset; metadata are parsed from ISA on demand"""
+        if name not in getattr(dataset, "assays", ()):
             msg = "Attempt to associate an assay with the wrong dataset"
             raise GeneLabException(msg)
         self.name = name
         self.dataset = dataset
+        self.sample_key = sample_key
+        self.metadatalikes = {}
+        self.file_index, self.file_index_nbytes = None, 0
+        self.metadata_filenames = LRUCache(
+            max_entries=FILE_LOOKUP_CACHE_MAX_ENTRIES, max_bytes=None,
+            sizeof=lambda filenames: getsizeof(filenames) + sum(
+                map(getsizeof, filenames),
+            ),
+        )
+ 
+    def memory_usage(self):
+        """Estimate memory footprint of metas and file lookups built so far in bytes"""
+        return self.file_index_nbytes + self.metadata_filenames.nbytes + sum(
+            metadatalike.memory_usage()
+            for metadatalike in list(self.metadatalikes.values())
+        )
+ 
+    def make_metadatalike(self, attribute):
+        """Parse one of assay's metas from ISA"""
         try:
-            assays_isa = dataset.isa.assays[name]
-            samples_isa = dataset.isa.samples[sample_key]
-            ML = MetadataLike
-            self.metadata = ML(assays_isa)
-            self.factors = ML(samples_isa, use="factor value")
-            self.parameters = ML(samples_isa, use="parameter value")
-            self.characteristics = ML(samples_isa, use="characteristics")
-            self.comments = ML(samples_isa, use="comment")
-            self.properties = ML(samples_isa, discard={
-                "factor value", "parameter value", "characteristics", "comment",
-            })
-            self.assay_types = ML(infer_assay_types(name), like=self.comments)
+            if attribute == "metadata":
+                return MetadataLike(self.dataset.isa.assays[self.name])
+            elif attribute == "assay_types":
+                return MetadataLike(
+                    infer_assay_types(self.name), like=self.comments,
+                )
+            samples_isa = self.dataset.classify_samples(self.sample_key)
+            if attribute == "factors":
+                return MetadataLike(samples_isa, use="factor value")
+            elif attribute == "parameters":
+                return MetadataLike(samples_isa, use="parameter value")
+            elif attribute == "characteristics":
+                return MetadataLike(samples_isa, use="characteristics")
+            elif attribute == "comments":
+                return MetadataLike(samples_isa, use="comment")
+            elif attribute == "properties":
+                return MetadataLike(samples_isa, discard=ISA_COLUMN_CATEGORIES)
+            else:
+                raise GeneLabException("Unknown meta: " + attribute)
         except IndexError as e:
-            msg = "{}, {}: {}".format(dataset.accession, name, e)
+            msg = "{}, {}: {}".format(self.dataset.accession, self.name, e)
             raise GeneLabJSONException(msg)
  
+    metadata = lazy_metadatalike("metadata")
+    factors = lazy_metadatalike("factors")
+    parameters = lazy_metadatalike("parameters")
+    characteristics = lazy_metadatalike("characteristics")
+    comments = lazy_metadatalike("comments")
+    properties = lazy_metadatalike("properties")
+    assay_types = lazy_metadatalike("assay_types")
+ 
     def __getattr__(self, attribute):
         """Allow asking for metas with spaces: e.g., getattr(self, "assay types")"""
         if " " in attribute:
@@ -192,6 +373,46 @@ class ColdStorageAssay():
                 "ColdStorageAssay", attribute,
             ))
  
+    def make_file_index(self):
+        """Map sample names to fields to names of dataset files mentioned in metadata"""
+        file_index = {}
+        metadata_df = self.metadata.full
+        fields = metadata_df.columns.get_level_values(0)
+        for sample_name, row in zip(metadata_df.index, metadata_df.values):
+            sample_files = file_index.setdefault(sample_name, {})
+            for field, cell_value in zip(fields, row):
+                if isinstance(field, str) and isinstance(cell_value, str):
+                    sample_files.setdefault(field, set()).update(
+                        filename for filename in split(r'\s*,\s*', cell_value)
+                        if filename in self.dataset.fileurls
+                    )
+        return file_index
+ 
+    def get_metadata_filenames(self, sample_mask=".*", field_mask=".*"):
+        """Get names of files mentioned in metadata of matching samples and fields"""
+        masks = sample_mask, field_mask
+        metadata_filenames = self.metadata_filenames.get(masks)
+        if metadata_filenames is None:
+            if self.file_index is None:
+                file_index = self.make_file_index()
+                self.file_index_nbytes = getsizeof(file_index) + sum(
+                    getsizeof(sample_files) + sum(
+                        getsizeof(filenames) for filenames
+                        in sample_files.values()
+                    )
+                    for sample_files in file_index.values()
+                )
+                self.file_index = file_index
+            metadata_filenames = set.union(set(), *(
+                filenames
+                for sample_name, sample_files in self.file_index.items()
+                if search(sample_mask, sample_name)
+                for field, filenames in sample_files.items()
+                if search(field_mask, field)
+            ))
+            self.metadata_filenames.put(masks, metadata_filenames)
+        return metadata_filenames
+ 
     def resolve_filename(self, mask, sample_mask=".*", field_mask=".*"):
         """Given masks, find filenames, urls, and datestamps"""
         dataset_level_files = self.dataset.resolve_filename(mask)
@@ -201,25 +422,47 @@ class ColdStorageAssay():
         elif (len(dataset_level_files) == 1) and (not metadata_filters_present):
             return dataset_level_files
         else:
-            metadata_df = self.metadata.full
-            sample_names = [
-                sn for sn in metadata_df.index if search(sample_mask, sn)
-            ]
-            fields = [
-                fn for fn in metadata_df.columns.get_level_values(0)
-                if search(field_mask, fn)
-            ]
-            metadata_subset_filenames = set.union(set(), *[
-                split(r'\s*,\s*', cell_value) for cell_value
-                in metadata_df.loc[sample_names, fields].values.flatten()
-            ])
+            metadata_subset_filenames = self.get_metadata_filenames(
+                sample_mask, field_mask,
+            )
             return {
                 filename: fileinfo
                 for filename, fileinfo in dataset_level_files.items()
                 if filename in metadata_subset_filenames
             }
  
-    def get_file(self, mask, sample_mask=".*", field_mask=".*", astype=None, sep=None):
+    def read_table(self, fileinfo, handle, sep=None):
+        """Parse processed table and force default name delimiter in sample names"""
+        filedata = read_csv(
+            handle, sep=sep, compression=infer_compression(fileinfo.filename),
+        )
+        if filedata.columns[0] == "Unnamed: 0":
+            filedata.columns = (
+                [self.metadata.indexed_by] + list(filedata.columns[1:])
+            )
+        INPLACE_force_default_name_delimiter_in_file_data(
+            filedata,
+            metadata_indexed_by=self.metadata.indexed_by,
+            metadata_name_set=set(self.metadata.full.index),
+        )
+        return filedata
+ 
+    @contextmanager
+    def open_columnar_table(self, fileinfo, sep=None):
+        """Convert processed table to columnar format once, keep it cached while in context"""
+        def convert(_, directory):
+            with download_to_temporary_file(fileinfo.url) as handle:
+                write_columnar(
+                    self.read_table(fileinfo, handle, sep), directory,
+                    gene_columns=GENE_SYMBOL_COLUMNS,
+                )
+        with FILE_CACHE.pinned(
+                COLUMNAR_KEY_MASK.format(COLUMNAR_FORMAT, sep, fileinfo.url),
+                fileinfo.timestamp, convert, isdir=True,
+            ) as directory:
+            yield ColumnarTable(directory)
+ 
+    def get_file(self, mask, sample_mask=".*", field_mask=".*", astype=None, sep=None, columns=None, genes=None):
         """Given masks, read file data directly from cold storage"""
         fileinfos = self.resolve_filename(mask, sample_mask, field_mask)
         if len(fileinfos) == 0:
@@ -229,20 +472,27 @@ class ColdStorageAssay():
         else:
             fileinfo = copy(next(iter(fileinfos.values())))
         if astype is None:
-            with urlopen(fileinfo.url) as response:
-                fileinfo.filedata = response.read()
+            with open_file(fileinfo) as handle:
+                fileinfo.filedata = handle.read()
         elif astype is DataFrame:
-            fileinfo.filedata = read_csv(fileinfo.url, sep=sep)
-            if fileinfo.filedata.columns[0] == "Unnamed: 0":
-                fileinfo.filedata.columns = (
-                    [self.metadata.indexed_by] +
-                    list(fileinfo.filedata.columns[1:])
-                )
-            INPLACE_force_default_name_delimiter_in_file_data(
-                fileinfo.filedata,
-                metadata_indexed_by=self.metadata.indexed_by,
-                metadata_name_set=set(self.metadata.full.index),
-            )
+            if fileinfo.timestamp < 0: # changes undetectable, do not convert
+                with download_to_temporary_file(fileinfo.url) as handle:
+                    filedata = self.read_table(fileinfo, handle, sep)
+                if genes is not None:
+                    filedata = filedata[filedata[[
+                        c for c in filedata.columns[:1].tolist() +
+                        list(GENE_SYMBOL_COLUMNS) if c in filedata.columns
+                    ]].isin(set(genes)).any(axis=1)]
+                if columns is not None:
+                    filedata = filedata[list(filedata.columns[:1]) + [
+                        c for c in columns
+                        if (c in filedata.columns) and (c != filedata.columns[0])
+                    ]]
+                fileinfo.filedata = filedata
+            else:
+                with self.open_columnar_table(fileinfo, sep) as table:
+                    rows = None if genes is None else table.find_rows(genes)
+                    fileinfo.filedata = table.read(columns, rows)
         else:
             raise NotImplementedError("Unsupported astype in get_file()")
         return fileinfo
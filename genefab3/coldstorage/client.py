@@ -0,0 +1,281 @@
+from genefab3.config import COLD_STORAGE_MAX_CONNECTIONS_PER_HOST
+from genefab3.config import COLD_STORAGE_TIMEOUT, COLD_STORAGE_RETRIES
+from genefab3.config import COLD_STORAGE_POOL_TIMEOUT
+from genefab3.config import COLD_STORAGE_RETRY_BACKOFF
+from genefab3.config import COLD_STORAGE_BREAKER_THRESHOLD
+from genefab3.config import COLD_STORAGE_BREAKER_COOLDOWN
+from genefab3.config import COLD_STORAGE_BREAKER_MAX_COOLDOWN
+from genefab3.exceptions import GeneLabColdStorageException
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlsplit, urlunsplit, urljoin
+from urllib.error import HTTPError
+from ssl import create_default_context
+from socket import timeout as SocketTimeout
+from threading import BoundedSemaphore, Lock
+from contextlib import contextmanager
+from gzip import GzipFile
+from io import BufferedIOBase
+from random import uniform
+from time import sleep, time
+
+
+RETRIABLE_STATUSES = {429, 500, 502, 503, 504}
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+MAX_REDIRECTS = 5
+
+
+class CircuitBreaker():
+    """Tracks health of host and fails requests fast while it is down"""
+ 
+    def __init__(self, threshold=COLD_STORAGE_BREAKER_THRESHOLD, cooldown=COLD_STORAGE_BREAKER_COOLDOWN, max_cooldown=COLD_STORAGE_BREAKER_MAX_COOLDOWN):
+        """Initialize closed breaker"""
+        self.threshold, self.cooldown = threshold, cooldown
+        self.max_cooldown = max_cooldown
+        self.failures, self.trips, self.retry_at = 0, 0, 0
+        self.probing, self.lock = False, Lock()
+ 
+    @property
+    def state(self):
+        """Report state of breaker"""
+        if self.failures < self.threshold:
+            return "closed"
+        elif self.probing or (time() >= self.retry_at):
+            return "half-open"
+        else:
+            return "open"
+ 
+    def seconds_until_probe(self):
+        """Report how long requests will fail fast"""
+        if self.state == "open":
+            return max(0, self.retry_at - time())
+        else:
+            return 0
+ 
+    def allow(self):
+        """Check if request may be sent; in half-open state, let only one probe through at a time"""
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            elif (state == "half-open") and (not self.probing):
+                self.probing = True
+                return True
+            else:
+                return False
+ 
+    def record_success(self):
+        """Close breaker"""
+        with self.lock:
+            self.failures, self.trips, self.probing = 0, 0, False
+ 
+    def record_failure(self):
+        """Count failure; open breaker (again, for twice as long) if over threshold or if probe failed"""
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                cooldown = min(
+                    self.cooldown * 2 ** self.trips, self.max_cooldown,
+                )
+                self.trips += 1
+                self.retry_at, self.probing = time() + cooldown, False
+ 
+    def report(self):
+        """Describe state of breaker for monitoring"""
+        return {
+            "state": self.state, "consecutive failures": self.failures,
+            "trips": self.trips,
+            "seconds until probe": round(self.seconds_until_probe(), 1),
+        }
+
+
+class ConnectionPool():
+    """Keep-alive connections to one host, capped in number"""
+ 
+    def __init__(self, scheme, netloc, max_connections, timeout, pool_timeout=COLD_STORAGE_POOL_TIMEOUT):
+        """Initialize empty pool"""
+        self.scheme, self.netloc, self.timeout = scheme, netloc, timeout
+        self.pool_timeout = pool_timeout
+        self.semaphore = BoundedSemaphore(max_connections)
+        self.idle, self.lock = [], Lock()
+        self.breaker = CircuitBreaker()
+        if scheme == "https":
+            self.context = create_default_context()
+        elif scheme != "http":
+            raise ValueError("Unsupported URL scheme: '{}'".format(scheme))
+ 
+    def acquire(self):
+        """Wait for a free slot, reuse idle connection or open a new one"""
+        if not self.semaphore.acquire(timeout=self.pool_timeout):
+            msg = "No free connection to cold storage host {} in {}s".format(
+                self.netloc, self.pool_timeout,
+            )
+            raise GeneLabColdStorageException(msg)
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        if self.scheme == "https":
+            return HTTPSConnection(
+                self.netloc, timeout=self.timeout, context=self.context,
+            )
+        else:
+            return HTTPConnection(self.netloc, timeout=self.timeout)
+ 
+    def release(self, connection, reusable=True):
+        """Return connection to pool, or close it if not `reusable`"""
+        if reusable:
+            with self.lock:
+                self.idle.append(connection)
+        else:
+            connection.close()
+        self.semaphore.release()
+ 
+    def drain(self, connection, response):
+        """Read rest of response body and return connection to pool; close connection if body cannot be read"""
+        try:
+            response.read()
+        except BaseException:
+            self.release(connection, reusable=False)
+            raise
+        self.release(connection, reusable=not response.will_close)
+
+
+class ClientResponse(BufferedIOBase):
+    """Status, headers and decoded body stream of response"""
+ 
+    def __init__(self, url, response):
+        """Wrap http.client response, decompressing gzip-encoded body"""
+        self.url, self.status = url, response.status
+        self.reason, self.headers = response.reason, response.headers
+        encoding = response.getheader("Content-Encoding", "").lower()
+        if encoding == "gzip":
+            self.stream = GzipFile(fileobj=response, mode="rb")
+        else:
+            self.stream = response
+ 
+    def readable(self):
+        """Body can be read (as bytes)"""
+        return True
+ 
+    def read(self, size=-1):
+        """Read decoded body"""
+        if (size is None) or (size < 0):
+            return self.stream.read()
+        else:
+            return self.stream.read(size)
+ 
+    def read1(self, size=-1):
+        """Read decoded body with at most one call to underlying stream"""
+        return self.stream.read1(size)
+ 
+    def readline(self, size=-1):
+        """Read line of decoded body"""
+        return self.stream.readline(size)
+
+
+class ColdStorageClient():
+    """HTTP client with per-host pools of keep-alive connections, retries and redirects"""
+ 
+    def __init__(self, max_connections_per_host=COLD_STORAGE_MAX_CONNECTIONS_PER_HOST, timeout=COLD_STORAGE_TIMEOUT, retries=COLD_STORAGE_RETRIES, backoff=COLD_STORAGE_RETRY_BACKOFF, pool_timeout=COLD_STORAGE_POOL_TIMEOUT):
+        """Initialize client without connections"""
+        self.max_connections_per_host = max_connections_per_host
+        self.pool_timeout = pool_timeout
+        self.timeout, self.retries, self.backoff = timeout, retries, backoff
+        self.pools, self.lock = {}, Lock()
+ 
+    def get_pool(self, scheme, netloc):
+        """Get connection pool for host"""
+        with self.lock:
+            if (scheme, netloc) not in self.pools:
+                self.pools[(scheme, netloc)] = ConnectionPool(
+                    scheme, netloc, self.max_connections_per_host,
+                    self.timeout, self.pool_timeout,
+                )
+            return self.pools[(scheme, netloc)]
+ 
+    def request(self, url, headers):
+        """Send GET request, retrying on errors; return pool, connection and response"""
+        scheme, netloc, path, query, _ = urlsplit(url)
+        pool = self.get_pool(scheme, netloc)
+        selector = urlunsplit(("", "", path or "/", query, ""))
+        headers = dict(headers or {}, **{"Accept-Encoding": "gzip"})
+        if not pool.breaker.allow():
+            msg = "Cold storage host {} unavailable, retrying in {:.0f}s".format(
+                netloc, pool.breaker.seconds_until_probe(),
+            )
+            raise GeneLabColdStorageException(msg)
+        try:
+            for attempt in range(self.retries + 1):
+                connection = pool.acquire()
+                try:
+                    connection.request("GET", selector, headers=headers)
+                    response = connection.getresponse()
+                except SocketTimeout: # retrying would multiply callers' wait
+                    pool.release(connection, reusable=False)
+                    raise
+                except (OSError, HTTPException): # incl. stale keep-alive
+                    pool.release(connection, reusable=False)
+                    if attempt == self.retries:
+                        raise
+                else:
+                    retriable = response.status in RETRIABLE_STATUSES
+                    if retriable and (attempt < self.retries):
+                        pool.drain(connection, response)
+                    else:
+                        if retriable:
+                            pool.breaker.record_failure()
+                        else:
+                            pool.breaker.record_success()
+                        return pool, connection, response
+                sleep(uniform(0, self.backoff * 2 ** attempt))
+        except BaseException:
+            pool.breaker.record_failure()
+            raise
+ 
+    def get_breaker(self, url):
+        """Get circuit breaker of host of `url`"""
+        scheme, netloc, *_ = urlsplit(url)
+        return self.get_pool(scheme, netloc).breaker
+ 
+    def health(self):
+        """Describe circuit breaker states of all hosts contacted so far"""
+        with self.lock:
+            pools = list(self.pools.items())
+        return [
+            dict(host=netloc, scheme=scheme, **pool.breaker.report())
+            for (scheme, netloc), pool in pools
+        ]
+ 
+    @contextmanager
+    def open(self, url, headers=None):
+        """Request `url`, following redirects; yield ClientResponse, raise HTTPError on errors"""
+        for _ in range(MAX_REDIRECTS + 1):
+            pool, connection, response = self.request(url, headers)
+            location = response.getheader("Location")
+            if (response.status in REDIRECT_STATUSES) and location:
+                pool.drain(connection, response)
+                url = urljoin(url, location)
+            else:
+                break
+        else:
+            msg = "Too many redirects"
+            raise HTTPError(url, response.status, msg, response.headers, None)
+        try:
+            if (response.status >= 300) and (response.status != 304):
+                response.read()
+                raise HTTPError(
+                    url, response.status, response.reason, response.headers,
+                    None,
+                )
+            else:
+                yield ClientResponse(url, response)
+        finally:
+            reusable = False # unless body was read to the end
+            try:
+                if response.status == 304:
+                    response.read() # empty, but marks response as complete
+                reusable = response.isclosed() and (not response.will_close)
+            finally:
+                pool.release(connection, reusable=reusable)
+
+
+COLD_STORAGE_CLIENT = ColdStorageClient()
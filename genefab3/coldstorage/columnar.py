@@ -0,0 +1,137 @@
+from numpy import save, load, array, argsort, unique, concatenate, nan
+from pandas import DataFrame, RangeIndex, isnull
+from json import dump, load as load_json
+from os import path
+
+
+COLUMNAR_FORMAT = 3
+
+
+def is_default_index(index):
+    """Check if index is the default one produced by read_csv"""
+    return isinstance(index, RangeIndex) and (index.start == 0) and (
+        index.step == 1
+    )
+
+
+def write_gene_index(dataframe, directory, gene_columns):
+    """Store sorted gene identifiers/symbols from identifier (first) column and `gene_columns`, with their row offsets"""
+    keys, rows = [], []
+    for column in dataframe.columns[:1].tolist() + [
+            c for c in gene_columns if c in dataframe.columns[1:]
+        ]:
+        for i, value in enumerate(dataframe[column]):
+            if isinstance(value, str):
+                keys.append(value)
+                rows.append(i)
+    keys, rows = array(keys, dtype=str), array(rows, dtype=int)
+    order = argsort(keys, kind="stable")
+    save(path.join(directory, "genes.npy"), keys[order], allow_pickle=False)
+    save(path.join(directory, "rows.npy"), rows[order], allow_pickle=False)
+
+
+def write_columnar(dataframe, directory, gene_columns=()):
+    """Store DataFrame in `directory` as one NumPy file per column, with index of genes"""
+    columns = []
+    for i, (name, values) in enumerate(dataframe.items()):
+        spec = {"name": name, "file": "{}.npy".format(i)}
+        if values.dtype.kind in "biuf":
+            array = values.values
+        else:
+            mask = isnull(values).values
+            if all(isinstance(v, str) for v in values[~mask]):
+                array = values.where(~mask, "").values.astype(str) # mappable
+                if mask.any(): # missing text values restored from mask
+                    spec["mask"] = "{}.mask.npy".format(i)
+                    save(
+                        path.join(directory, spec["mask"]), mask,
+                        allow_pickle=False,
+                    )
+            else: # mixed values cannot be mapped; keep in header
+                columns.append({"name": name, "values": values.tolist()})
+                continue
+        save(path.join(directory, spec["file"]), array, allow_pickle=False)
+        columns.append(spec)
+    header = {
+        "format": COLUMNAR_FORMAT, "nrows": len(dataframe), "columns": columns,
+        "index": (
+            None if is_default_index(dataframe.index)
+            else dataframe.index.tolist()
+        ),
+    }
+    write_gene_index(dataframe, directory, gene_columns)
+    with open(path.join(directory, "header.json"), mode="wt") as handle:
+        dump(header, handle, default=str)
+
+
+class ColumnarTable():
+    """Table stored by write_columnar(), read column by column from memory-mapped NumPy files"""
+ 
+    def __init__(self, directory):
+        """Read header of stored table"""
+        with open(path.join(directory, "header.json"), mode="rt") as handle:
+            header = load_json(handle)
+        self.directory, self.nrows = directory, header["nrows"]
+        self.specs = {spec["name"]: spec for spec in header["columns"]}
+        self.columns = [spec["name"] for spec in header["columns"]]
+        self.index = header["index"]
+ 
+    def load_array(self, filename, rows=None):
+        """Read values from memory-mapped NumPy file, only at positions `rows` if given"""
+        array = load(
+            path.join(self.directory, filename), mmap_mode="r",
+            allow_pickle=False,
+        )
+        return array[:] if rows is None else array[rows]
+ 
+    def read_column(self, name, rows=None):
+        """Read values of one column, only at positions `rows` if given"""
+        spec = self.specs[name]
+        if "file" in spec:
+            values = self.load_array(spec["file"], rows)
+            if "mask" in spec:
+                values = values.astype(object)
+                values[self.load_array(spec["mask"], rows)] = nan
+            return values
+        elif rows is None:
+            return spec["values"]
+        else:
+            return [spec["values"][i] for i in rows]
+ 
+    def find_rows(self, genes):
+        """Find sorted row offsets of `genes` (identifiers or symbols) via binary search in memory-mapped gene index"""
+        keys, rows = (
+            load(path.join(self.directory, f), mmap_mode="r", allow_pickle=False)
+            for f in ("genes.npy", "rows.npy")
+        )
+        max_length = keys.dtype.itemsize // 4 # longer ones would be truncated
+        genes = sorted(g for g in genes if len(g) <= max_length)
+        if (len(keys) == 0) or (len(genes) == 0):
+            return []
+        genes = array(genes, dtype=keys.dtype)
+        starts = keys.searchsorted(genes, side="left")
+        ends = keys.searchsorted(genes, side="right")
+        return unique(concatenate(
+            [rows[start:end] for start, end in zip(starts, ends)] + [[]],
+        ).astype(int)).tolist()
+ 
+    def read(self, columns=None, rows=None):
+        """Read identifier column, `columns` and `rows` (all if None) into DataFrame"""
+        if columns is None:
+            columns = self.columns
+        else:
+            columns = self.columns[:1] + [
+                c for c in columns if c != self.columns[0]
+            ]
+        if rows is None:
+            index = RangeIndex(self.nrows) if self.index is None else self.index
+        else:
+            rows = list(rows)
+            index = rows if self.index is None else [self.index[i] for i in rows]
+        return DataFrame(
+            {
+                name: self.read_column(name, rows)
+                for name in columns if name in self.specs
+            },
+            index=index,
+        )
@@ -1,12 +1,21 @@
-from sys import stderr
-from re import search, sub
+from sys import stderr, getsizeof
+from re import sub, compile
 from genefab3.exceptions import GeneLabException, GeneLabJSONException
-from genefab3.config import GENELAB_ROOT
+from genefab3.config import GENELAB_ROOT, FILE_LOOKUP_CACHE_MAX_ENTRIES
 from genefab3.utils import download_cold_json as dl_json
 from genefab3.utils import extract_file_timestamp, levenshtein_distance
-from genefab3.coldstorage.assay import ColdStorageAssay
+from genefab3.coldstorage.assay import ColdStorageAssay, ClassifiedISATable
+from genefab3.caching import LRUCache
 from argparse import Namespace
 from genefab3.isa.parser import ISA
+from pandas import DataFrame
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def compile_mask(mask):
+    """Compile filename mask once per process"""
+    return compile(mask)
 
 
 def parse_fileurls_json(fileurls_json):
@@ -34,34 +43,88 @@ def parse_filedates_json(filedates_json):
 class ColdStorageDataset():
     """Contains GLDS metadata associated with an accession number"""
  
-    def __init__(self, accession, glds_json=None, fileurls_json=None, filedates_json=None):
-        """Request ISA and store fields"""
-        self.isa = ISA(glds_json or dl_json(accession, "glds"))
+    def __init__(self, accession, glds_json=None, fileurls_json=None, filedates_json=None, isa=None, fileurls=None, filedates=None):
+        """Request ISA and store fields; `isa`, `fileurls` and `filedates` parsed earlier (e.g. kept in snapshot) are used as-is"""
+        if isa is None:
+            isa = ISA(glds_json or dl_json(accession, "glds")[0])
+        self.isa = isa
         if accession not in {self.isa.accession, self.isa.legacy_accession}:
             raise GeneLabException("Initializing dataset with wrong JSON")
         else:
             self.accession = accession
-        self.fileurls = parse_fileurls_json(
-            fileurls_json or dl_json(accession, "fileurls"),
-        )
-        self.filedates = parse_filedates_json(
-            filedates_json or dl_json(self.isa._id, "filedates"),
+        if fileurls is None:
+            fileurls = parse_fileurls_json(
+                fileurls_json or dl_json(accession, "fileurls")[0],
+            )
+        if filedates is None:
+            filedates = parse_filedates_json(
+                filedates_json or dl_json(self.isa._id, "filedates")[0],
+            )
+        self.fileurls, self.filedates = fileurls, filedates
+        self.classified_samples, self.isa_nbytes = {}, None
+        self.file_index, self.file_index_nbytes = None, 0
+        self.resolved_masks = LRUCache(
+            max_entries=FILE_LOOKUP_CACHE_MAX_ENTRIES, max_bytes=None,
+            sizeof=getsizeof, # matches are shared with file index
         )
         try:
-            self.assays = {a: None for a in self.isa.assays} # placeholders
-            self.assays = ColdStorageAssayDispatcher(self) # actual assays
+            self.assays = ColdStorageAssayDispatcher(self)
         except (KeyError, TypeError):
             raise GeneLabJSONException("Invalid JSON (field 'assays')")
  
+    def memory_usage(self):
+        """Estimate memory footprint of parsed tables and of lookups built from them, in bytes"""
+        if self.isa_nbytes is None: # ISA tables do not change once parsed
+            self.isa_nbytes = sum(
+                int(table.memory_usage(deep=True).sum())
+                for tables in (self.isa.assays, self.isa.samples)
+                if isinstance(tables, dict)
+                for table in tables.values() if isinstance(table, DataFrame)
+            )
+        return (
+            self.isa_nbytes + self.file_index_nbytes +
+            self.resolved_masks.nbytes + sum(
+                classified.memory_usage()
+                for classified in list(self.classified_samples.values())
+            ) + sum(
+                assay.memory_usage() for assay in list(dict.values(self.assays))
+                if assay is not None
+            )
+        )
+ 
+    def classify_samples(self, sample_key):
+        """Classify columns of samples table once for all assays sharing it"""
+        if sample_key not in self.classified_samples:
+            self.classified_samples[sample_key] = ClassifiedISATable(
+                self.isa.samples[sample_key],
+            )
+        return self.classified_samples[sample_key]
+ 
     def resolve_filename(self, mask):
         """Given mask, find filenames, urls, and datestamps"""
-        return {
-            filename: Namespace(
-                filename=filename, url=url,
-                timestamp=self.filedates.get(filename, -1)
+        if self.file_index is None:
+            file_index = {
+                filename: Namespace(
+                    filename=filename, url=url,
+                    timestamp=self.filedates.get(filename, -1)
+                )
+                for filename, url in self.fileurls.items()
+            }
+            self.file_index_nbytes = getsizeof(file_index) + sum(
+                getsizeof(fileinfo) + getsizeof(vars(fileinfo))
+                for fileinfo in file_index.values()
             )
-            for filename, url in self.fileurls.items() if search(mask, filename)
-        }
+            self.file_index = file_index
+        resolved = self.resolved_masks.get(mask)
+        if resolved is None:
+            matches = compile_mask(mask).search
+            resolved = {
+                filename: fileinfo
+                for filename, fileinfo in self.file_index.items()
+                if matches(filename)
+            }
+            self.resolved_masks.put(mask, resolved)
+        return dict(resolved)
 
 
 def infer_sample_key(assay_name, keys):
@@ -104,19 +167,40 @@ class ColdStorageAssayDispatcher(dict):
     """Contains a dataset's assay objects, indexable by name or by attributes"""
  
     def __init__(self, dataset):
-        """Populate dictionary of assay_name -> Assay()"""
+        """Register assay names; Assay() objects are built on first access"""
+        self.dataset = dataset
         for assay_name in dataset.isa.assays:
-            sample_key = infer_sample_key(assay_name, dataset.isa.samples)
-            if levenshtein_distance(assay_name, sample_key) > 1:
-                msg = "Warning: ld('{}', '{}')".format(assay_name, sample_key)
-                print(msg, file=stderr)
-            super().__setitem__(
-                assay_name, ColdStorageAssay(dataset, assay_name, sample_key)
-            )
+            super().__setitem__(assay_name, None)
+ 
+    def make_assay(self, assay_name):
+        """Match assay to its samples and build Assay()"""
+        sample_key = infer_sample_key(assay_name, self.dataset.isa.samples)
+        if levenshtein_distance(assay_name, sample_key) > 1:
+            msg = "Warning: ld('{}', '{}')".format(assay_name, sample_key)
+            print(msg, file=stderr)
+        return ColdStorageAssay(self.dataset, assay_name, sample_key)
  
     def __getitem__(self, assay_name):
-        """Get assay by name or alias"""
+        """Get assay by name or alias, building it if not yet built"""
         if (assay_name == "assay") and (len(self) == 1):
-            return dict.__getitem__(self, next(iter(self)))
-        else:
-            return dict.__getitem__(self, assay_name)
+            assay_name = next(iter(self))
+        assay = dict.__getitem__(self, assay_name)
+        if assay is None:
+            assay = self.make_assay(assay_name)
+            super().__setitem__(assay_name, assay)
+        return assay
+ 
+    def get(self, assay_name, default=None):
+        """Get assay by name or alias if present, building it if not yet built"""
+        try:
+            return self[assay_name]
+        except KeyError:
+            return default
+ 
+    def values(self):
+        """Iterate over assays, building them as needed"""
+        return (self[assay_name] for assay_name in self)
+ 
+    def items(self):
+        """Iterate over (name, assay) pairs, building assays as needed"""
+        return ((assay_name, self[assay_name]) for assay_name in self)
@@ -0,0 +1,71 @@
+from genefab3.coldstorage.dataset import ColdStorageDataset
+from genefab3.isa.parser import ISA
+from pandas import DataFrame, MultiIndex
+from numpy import empty
+from json import dumps, loads
+from zlib import compress, decompress
+
+
+SNAPSHOT_FORMAT = 3
+
+
+def serialize_isa_table(isa_table):
+    """Convert ISATable to JSON-compatible header (titles, fields) and rows"""
+    return {
+        "titles": isa_table.columns.get_level_values(0).tolist(),
+        "fields": isa_table.columns.get_level_values(1).tolist(),
+        "values": isa_table.values.tolist(),
+    }
+
+
+def deserialize_isa_table(entries):
+    """Restore ISATable from header and rows, allocating values once"""
+    titles, fields = entries["titles"], entries["fields"]
+    values = empty((len(entries["values"]), len(fields)), dtype=object)
+    for i, row in enumerate(entries["values"]):
+        values[i, :] = row
+    return DataFrame(
+        data=values, columns=MultiIndex.from_arrays(
+            [titles, fields], names=["title", "index"],
+        ),
+    )
+
+
+def serialize_isa(isa):
+    """Convert parsed ISA fields to JSON-compatible form"""
+    return {
+        key: {
+            name: serialize_isa_table(isa_table)
+            for name, isa_table in value.items()
+        } if key in {"assays", "samples"} and isinstance(value, dict)
+        else value
+        for key, value in vars(isa).items()
+    }
+
+
+def serialize_dataset(glds):
+    """Convert parsed dataset to compressed JSON snapshot of its ISA fields and file listings"""
+    return compress(dumps({
+        "format": SNAPSHOT_FORMAT, "accession": glds.accession,
+        "isa": serialize_isa(glds.isa),
+        "fileurls": glds.fileurls, "filedates": glds.filedates,
+    }).encode())
+
+
+def deserialize_dataset(snapshot):
+    """Restore parsed dataset from snapshot through its constructor, without re-parsing ISA JSON"""
+    data = loads(decompress(snapshot).decode())
+    if data["format"] != SNAPSHOT_FORMAT:
+        raise ValueError("Unsupported snapshot format")
+    parsed_isa = {
+        key: {
+            name: deserialize_isa_table(entries)
+            for name, entries in value.items()
+        } if key in {"assays", "samples"} and isinstance(value, dict)
+        else value
+        for key, value in data["isa"].items()
+    }
+    return ColdStorageDataset(
+        data["accession"], isa=ISA(parsed=parsed_isa),
+        fileurls=data["fileurls"], filedates=data["filedates"],
+    )
@@ -1,4 +1,5 @@
 MONGO_DB_NAME = "genefab3"
+MONGO_INSERT_BATCH_SIZE = 1000
 
 DEBUG_MARKERS = {"development", "staging", "stage", "debug", "debugging"}
 
@@ -9,17 +10,52 @@ COMPRESSIBLE_MIMETYPES = [
 
 GENELAB_ROOT = "https://genelab-data.ndc.nasa.gov"
 COLD_API_ROOT = "https://genelab-data.ndc.nasa.gov/genelab"
-COLD_SEARCH_MASK = COLD_API_ROOT + "/data/search/?term=GLDS&type=cgene&size={}"
+COLD_SEARCH_MASK = COLD_API_ROOT + "/data/search/?term=GLDS&type=cgene&from={}&size={}"
 COLD_GLDS_MASK = COLD_API_ROOT + "/data/study/data/{}/"
 COLD_FILEURLS_MASK = COLD_API_ROOT + "/data/glds/files/{}"
 COLD_FILEDATES_MASK = COLD_API_ROOT + "/data/study/filelistings/{}"
 
 INDEX_BY = "Sample Name"
+ISA_COLUMN_CATEGORIES = (
+    "factor value", "parameter value", "characteristics", "comment",
+)
 TIMESTAMP_FMT = "%a %b %d %H:%M:%S %Z %Y"
 
 MAX_JSON_AGE = 10800 # 3 hours (in seconds)
+MAX_STALE_JSON_AGE = 86400 # 24 hours (in seconds); requests wait past this age
+JSON_REVALIDATION_MAX_WORKERS = 4
+JSON_CACHE_COMPRESSION = None # or "zlib", "zstd" (if zstandard installed)
+JSON_CACHE_COMPRESSION_LEVEL = 6
 CACHER_THREAD_CHECK_INTERVAL = 1800 # 30 minutes (in seconds)
 CACHER_THREAD_RECHECK_INTERVAL = 300 # 5 minutes (in seconds)
+CACHER_THREAD_MAX_WORKERS = 8 # datasets refreshed concurrently
+COLD_STORAGE_MAX_CONNECTIONS_PER_HOST = 4
+COLD_SEARCH_PAGE_SIZE = 250 # search hits requested at a time
+COLD_SEARCH_MAX_MISSED_CYCLES = 2 # consecutive full searches missing dataset
+COLD_STORAGE_TIMEOUT = 60 # (in seconds) for connecting and for each read
+COLD_STORAGE_POOL_TIMEOUT = 120 # (in seconds) waiting for free connection
+COLD_STORAGE_RETRIES = 3 # on connection errors (not timeouts) and 429/5xx
+COLD_STORAGE_RETRY_BACKOFF = .5 # (in seconds) doubles with each retry
+COLD_STORAGE_BREAKER_THRESHOLD = 5 # consecutive failures that open breaker
+COLD_STORAGE_BREAKER_COOLDOWN = 10 # (in seconds) doubles while probes fail
+COLD_STORAGE_BREAKER_MAX_COOLDOWN = 600 # 10 minutes (in seconds)
+METADATA_SHADOW_REFRESH = False # build metas in new generation, then switch
+CACHER_LEASE_TTL = 180 # 3 minutes (in seconds)
+CACHER_LEASE_HEARTBEAT_INTERVAL = 30 # (in seconds)
+REFRESH_QUEUE_POLL_INTERVAL = 10 # (in seconds)
+REFRESH_QUEUE_CLAIM_TIMEOUT = 3600 # 1 hour (in seconds)
+SINGLEFLIGHT_ACROSS_PROCESSES = False # also coalesce JSON downloads via Mongo
+SINGLEFLIGHT_LEASE_TTL = 60 # (in seconds)
+DATASET_CACHE_MAX_ENTRIES = 64 # parsed datasets kept in memory per process
+DATASET_CACHE_MAX_BYTES = 1073741824 # 1 GiB (estimated from tables and metas)
+FILE_LOOKUP_CACHE_MAX_ENTRIES = 256 # memoized filename lookups per dataset/assay
+DATASET_SNAPSHOT_MAX_BYTES = 15728640 # 15 MiB (Mongo documents are <=16 MiB)
+CACHE_RETENTION = 1209600 # 14 days (in seconds) of keeping cache of removed datasets
+FILE_CACHE_DIR = "/tmp/genefab3/files" # downloaded processed tables
+FILE_CACHE_MAX_BYTES = 10737418240 # 10 GiB
+GENE_SYMBOL_COLUMNS = ("SYMBOL",) # genes can be selected by these or by ID
+DATA_QUERY_MAX_WORKERS = 4 # processed tables read concurrently per request
+DATA_QUERY_MAX_CELLS = 50000000 # ~400 MB of float64 values per request
 
 ASSAY_TYPES = {
     "dna", "rna", "protein",
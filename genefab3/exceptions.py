@@ -7,6 +7,7 @@ class GeneLabDatabaseException(Exception): pass
 class GeneLabJSONException(GeneLabException): pass
 class GeneLabFileException(Exception): pass
 class GeneLabDataManagerException(GeneLabException): pass
+class GeneLabColdStorageException(GeneLabException): pass
 
 
 def traceback_printer(e):
@@ -29,6 +30,8 @@ def exception_catcher(e):
         code, explanation = 501, "Not Implemented"
     elif isinstance(e, GeneLabDataManagerException):
         code, explanation = 500, "GeneLab Data Manager Internal Server Error"
+    elif isinstance(e, GeneLabColdStorageException):
+        code, explanation = 503, "Service Unavailable"
     else:
         code, explanation = 400, "Bad Request"
     error_mask = "<b>HTTP error</b>: {} ({})<br><b>{}</b>: {}"
@@ -13,4 +13,4 @@ def get_data_by_metas(db, context):
     if sample_columns.to_frame().isnull().any().all():
         raise GeneLabException("No data")
     else:
-        return query_data(sample_columns)
+        return query_data(db, sample_columns, gene_rows=context.genes)
@@ -1,11 +1,21 @@
 from genefab3.mongo.meta import get_dataset_with_caching
 from genefab3.exceptions import GeneLabException
+from genefab3.coldstorage.client import COLD_STORAGE_CLIENT
+from pandas import DataFrame
 
 
 def get_assay_metadata(db, accession, assay_name, meta, context):
-    glds = get_dataset_with_caching(db, accession)
+    glds = get_dataset_with_caching(db, accession, on_demand=True)
     assay = glds.assays[assay_name]
     try:
         return getattr(assay, meta).full.reset_index()
     except AttributeError:
         raise GeneLabException("Unknown meta: '{}'".format(meta))
+
+
+def get_cold_storage_health(db, context):
+    """Report circuit breaker states of cold storage hosts contacted by this process"""
+    return DataFrame(COLD_STORAGE_CLIENT.health(), columns=[
+        "host", "scheme", "state", "consecutive failures", "trips",
+        "seconds until probe",
+    ])
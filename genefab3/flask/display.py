@@ -327,7 +327,10 @@ def display_dataframe(df, context):
         mimetype = "text/html"
     else:
         raise NotImplementedError("fmt='{}'".format(fmt))
-    return Response(content, mimetype=mimetype)
+    response = Response(content, mimetype=mimetype)
+    for warning in df.attrs.get("warnings", ()):
+        response.headers.add("Warning", '199 - "{}"'.format(warning))
+    return response
 
 
 def display(obj, context):
@@ -1,6 +1,7 @@
 from genefab3.config import ASSAY_METADATALIKES
 from genefab3.exceptions import GeneLabException
 from genefab3.mongo.utils import get_collection_fields
+from genefab3.mongo.meta import get_meta_stores
 from pandas import DataFrame
 from natsort import natsorted
 from genefab3.utils import natsorted_dataframe, empty_df
@@ -19,7 +20,7 @@ def get_meta_names(db, meta, context):
         return DataFrame(
             data=natsorted(
                 get_collection_fields(
-                    collection=getattr(db, meta),
+                    collection=get_meta_stores(db)[meta],
                     skip={"accession", "assay name", "sample name"},
                 )
             ),
@@ -63,9 +64,9 @@ def get_displayable_dataframe_from_query(collection, meta, is_wildcard, context,
     )
 
 
-def get_annotation_by_one_meta(db, meta, context, drop_cols, info_cols, sample_level=True):
+def get_annotation_by_one_meta(collection, meta, context, drop_cols, info_cols, sample_level=True):
     """Generate dataframe of assays matching (AND) multiple `meta` queries"""
-    collection, by_one_meta = getattr(db, meta), None
+    by_one_meta = None
     if context.queries[meta]:
         by_one_meta = get_displayable_dataframe_from_query(
             collection, meta, False, context, drop_cols, info_cols,
@@ -124,10 +125,11 @@ def dropna_2d(annotation_by_metas, context, info_multicols, inplace=True):
 def get_annotation_by_metas(db, context, sample_level=True):
     """Select assays/samples based on annotation filters"""
     drop_cols, info_cols, info_multicols = get_info_cols(sample_level)
-    annotation_by_metas = None
+    annotation_by_metas, stores = None, get_meta_stores(db) # same generation
     for meta in ASSAY_METADATALIKES:
         annotation_by_one_meta = get_annotation_by_one_meta(
-            db, meta, context, drop_cols, info_cols, sample_level=sample_level,
+            stores[meta], meta, context, drop_cols, info_cols,
+            sample_level=sample_level,
         )
         if annotation_by_one_meta is SHRUNKEN_TO_NOTHING:
             return empty_df(columns=info_multicols)
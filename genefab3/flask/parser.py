@@ -1,5 +1,5 @@
 from genefab3.exceptions import GeneLabException
-from re import sub, escape
+from re import sub, escape, split
 from argparse import Namespace
 from genefab3.config import ASSAY_METADATALIKES
 from collections import defaultdict
@@ -42,6 +42,15 @@ def assay_selection_to_query(selection):
         return {}
 
 
+def parse_gene_selection(rargs_gene_list):
+    """Parse 'gene' request arguments (gene IDs or symbols, delimited by '|' or ',')"""
+    genes = {
+        gene.strip() for genes in rargs_gene_list
+        for gene in split(r'[|,]', genes)
+    }
+    return (genes - {""}) or None
+
+
 def parse_meta_queries(key, expressions):
     """Process queries like e.g. 'factors=age', 'factors!=age', 'factors:age=1|2', 'factors:age!=5'"""
     if key[-1] == "!":
@@ -89,6 +98,7 @@ def parse_request(request):
     context = Namespace(
         view="/"+sub(url_root, "", base_url).strip("/")+"/",
         select=parse_assay_selection(request.args.getlist("select")),
+        genes=parse_gene_selection(request.args.getlist("gene")),
         args=request.args,
         queries=defaultdict(list),
         fields=defaultdict(set),
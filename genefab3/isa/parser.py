@@ -87,8 +87,11 @@ def valmapper(function, ignore=AttributeError):
 
 
 class ISA(TurtleSpace):
-    """Parses GLDS JSON in ISA-Tab-like fashion"""
-    def __init__(self, json):
+    """Parses GLDS JSON in ISA-Tab-like fashion, or restores fields parsed earlier"""
+    def __init__(self, json=None, parsed=None):
+        if parsed is not None:
+            super().__init__(**parsed)
+            return
         ISATableDict = valmapper(ISATable)
         parser = Parser((None, 0), (1, Any),
             _copy_atoms=True, _copy_atomic_lists=True,
@@ -1,7 +1,7 @@
-from numpy import nan
+from numpy import nan, empty
 from argparse import Namespace
 from genefab3.exceptions import GeneLabJSONException
-from pandas import DataFrame, concat
+from pandas import DataFrame, MultiIndex
 
 
 Any, Atom = "Any", "Atom"
@@ -24,20 +24,29 @@ class TurtleSpace(Namespace):
 
 
 def ISATable(entries):
-    """Combines 'header' and 'raw' fields into two-level DataFrame"""
+    """Combines 'header' and 'raw' fields into two-level DataFrame, allocating values once"""
     try:
-        raw_header = DataFrame(entries["header"])
-        raw_values = DataFrame(entries["raw"])
-    except (KeyError, TypeError):
+        header, raw = entries["header"], entries["raw"]
+        fields = [h["field"] for h in header]
+        titles = {h["field"]: h.get("title", nan) for h in header}
+        is_encoded = any(h.get("encoded") for h in header)
+        known_fields = set(fields)
+        for row in raw: # fields missing from header go last, untitled
+            for field in row.keys():
+                if field not in known_fields:
+                    fields.append(field)
+                    known_fields.add(field)
+    except (KeyError, TypeError, AttributeError):
         raise GeneLabJSONException("Malformed ISA JSON table passed")
-    if raw_header["encoded"].any():
+    if is_encoded:
         raise GeneLabJSONException("Encoded fields are not supported")
     else:
-        return (
-            concat([
-                raw_header[["field", "title"]].set_index("field").T,
-                raw_values
-            ])
-            .T.reset_index()
-            .set_index(["title", "index"]).T
+        values = empty((len(raw), len(fields)), dtype=object)
+        for i, row in enumerate(raw):
+            values[i, :] = [row.get(field, nan) for field in fields]
+        return DataFrame(
+            data=values, columns=MultiIndex.from_arrays(
+                [[titles.get(field, nan) for field in fields], fields],
+                names=["title", "index"],
+            ),
         )
@@ -0,0 +1,72 @@
+from genefab3.config import COLD_SEARCH_MASK, COLD_SEARCH_PAGE_SIZE
+from genefab3.config import COLD_SEARCH_MAX_MISSED_CYCLES
+from genefab3.utils import download_cold_json, json_digest
+from genefab3.exceptions import GeneLabJSONException
+from genefab3.mongo.utils import iterate_batches
+from pymongo import UpdateOne
+from re import escape
+
+
+def ensure_cold_search_indexes(db):
+    """Index search hit digests by accession; drop whole search results cached in json_cache by earlier versions"""
+    db.cold_search.create_index("accession", unique=True)
+    db.json_cache.delete_many({
+        "identifier": {"$regex": "^" + escape(COLD_SEARCH_MASK.split("?")[0])},
+    })
+
+
+def iterate_cold_search_hits(page_size=COLD_SEARCH_PAGE_SIZE):
+    """Request cold storage dataset search page by page, yield individual hits"""
+    start = 0
+    while True:
+        page, _ = download_cold_json(
+            COLD_SEARCH_MASK.format(start, page_size),
+        )
+        try:
+            total, hits = page["hits"]["total"], page["hits"]["hits"]
+        except (KeyError, TypeError):
+            raise GeneLabJSONException("Malformed search JSON")
+        yield from hits
+        start += len(hits)
+        if (len(hits) == 0) or (start >= total):
+            break
+
+
+def iterate_cold_search(db, seen_at, page_size=COLD_SEARCH_PAGE_SIZE):
+    """Yield accessions found by cold storage search and whether their search hits changed"""
+    for hits in iterate_batches(iterate_cold_search_hits(page_size), page_size):
+        try:
+            digests = {hit["_id"]: json_digest(hit) for hit in hits}
+        except (KeyError, TypeError):
+            raise GeneLabJSONException("Malformed search JSON")
+        known_digests = {
+            entry["accession"]: entry["digest"]
+            for entry in db.cold_search.find(
+                {"accession": {"$in": list(digests)}},
+                {"accession": True, "digest": True},
+            )
+        }
+        db.cold_search.bulk_write([
+            UpdateOne(
+                {"accession": accession},
+                {"$set": {
+                    "digest": digest, "last_seen": seen_at, "missed_cycles": 0,
+                }},
+                upsert=True,
+            )
+            for accession, digest in digests.items()
+        ])
+        for accession, digest in digests.items():
+            yield accession, (
+                known_digests.get(accession, digest) != digest
+            )
+
+
+def drop_unseen_accessions(db, seen_at, max_missed_cycles=COLD_SEARCH_MAX_MISSED_CYCLES):
+    """Forget search hits of datasets not seen in last `max_missed_cycles` search cycles"""
+    # offset paging can skip hits while search results shift, so one miss
+    # does not mean a dataset is gone:
+    db.cold_search.update_many(
+        {"last_seen": {"$lt": seen_at}}, {"$inc": {"missed_cycles": 1}},
+    )
+    db.cold_search.delete_many({"missed_cycles": {"$gte": max_missed_cycles}})
@@ -1,12 +1,107 @@
-from pandas import Series, concat
-from numpy import nan
+from genefab3.config import VIZ_CSV_REGEX
+from genefab3.config import DATA_QUERY_MAX_WORKERS, DATA_QUERY_MAX_CELLS
+from genefab3.exceptions import GeneLabException
+from genefab3.utils import force_default_name_delimiter
+from genefab3.mongo.meta import get_dataset_with_caching
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from pandas import DataFrame, MultiIndex, concat, isnull
 
 
-def get_single_sample_data(triple):
-    return Series([nan]*16)
+GENE_ID_COLUMN = ("info", "info", "gene ID")
 
 
-def query_data(sample_columns, gene_rows=None):
-    sample_data = concat(sample_columns.map(get_single_sample_data), axis=1)
-    sample_data.columns = sample_columns
+def group_sample_columns(sample_columns):
+    """Group (accession, assay name, sample name) triples by assay, preserving order"""
+    groups = {}
+    for accession, assay_name, sample_name in sample_columns:
+        if not any(isnull(v) for v in (accession, assay_name, sample_name)):
+            groups.setdefault((accession, assay_name), []).append(sample_name)
+    return groups
+
+
+def get_assay_data(db, accession, assay_name, sample_names, gene_rows=None):
+    """Read requested samples and genes from processed table of assay; return data and warning"""
+    glds = get_dataset_with_caching(db, accession, on_demand=True)
+    if assay_name not in glds.assays:
+        msg = "No assay '{}' in {}".format(assay_name, accession)
+        raise GeneLabException(msg)
+    else:
+        assay = glds.assays[assay_name]
+    requested_columns = MultiIndex.from_tuples([
+        (accession, assay_name, s) for s in sample_names
+    ])
+    if not assay.resolve_filename(VIZ_CSV_REGEX):
+        msg = "No processed data for assay '{}' in {}".format(
+            assay_name, accession,
+        )
+        return DataFrame(columns=requested_columns, dtype=float), msg # NaNs
+    candidates = {} # sample names as-is and as normalized in processed tables
+    for sample_name in sample_names:
+        candidates.setdefault(sample_name, sample_name)
+        candidates.setdefault(
+            force_default_name_delimiter(sample_name), sample_name,
+        )
+    filedata = assay.get_file(
+        VIZ_CSV_REGEX, astype=DataFrame, sep=",", columns=list(candidates),
+        genes=gene_rows,
+    ).filedata
+    table = filedata.set_index(filedata.columns[0])
+    table = table.loc[~table.index.duplicated()]
+    found = {}
+    for column in table.columns:
+        found.setdefault(candidates[column], column)
+    data = table[[found[s] for s in sample_names if s in found]]
+    data.columns = MultiIndex.from_tuples([
+        (accession, assay_name, s) for s in sample_names if s in found
+    ])
+    return data.reindex(columns=requested_columns), None
+
+
+def query_data(db, sample_columns, gene_rows=None, max_workers=DATA_QUERY_MAX_WORKERS, max_cells=DATA_QUERY_MAX_CELLS):
+    """Assemble data of requested samples (and genes, if given) from processed tables of their assays"""
+    groups = group_sample_columns(sample_columns)
+    if not groups:
+        raise GeneLabException("No data")
+    def get_group_data(group):
+        (accession, assay_name), sample_names = group
+        return get_assay_data(
+            db, accession, assay_name, sample_names, gene_rows,
+        )
+    frames, warnings, ncells = [], [], 0
+    queued_groups = iter(groups.items())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = { # next table starts as soon as any one is read
+            executor.submit(get_group_data, group)
+            for group in islice(queued_groups, max_workers)
+        }
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                frame, warning = future.result()
+                ncells += frame.size
+                if ncells > max_cells: # stop reading other tables
+                    for pending in running:
+                        pending.cancel()
+                    msg = "Too much data requested (over {} values)".format(
+                        max_cells,
+                    )
+                    raise GeneLabException(msg)
+                frames.append(frame)
+                if warning is not None:
+                    warnings.append(warning)
+                for group in islice(queued_groups, 1):
+                    running.add(executor.submit(get_group_data, group))
+    sample_data = concat(frames, axis=1, sort=False)
+    sample_data = sample_data.reindex(columns=MultiIndex.from_tuples(list(
+        dict.fromkeys( # requested order, without duplicates
+            (accession, assay_name, sample_name)
+            for accession, assay_name, sample_name in sample_columns
+            if (accession, assay_name) in groups
+            if not isnull(sample_name)
+        )
+    )))
+    sample_data.insert(0, GENE_ID_COLUMN, sample_data.index)
+    sample_data = sample_data.reset_index(drop=True)
+    sample_data.attrs["warnings"] = warnings # assays without data
     return sample_data
@@ -0,0 +1,68 @@
+from uuid import uuid4
+
+
+INDEX_OPTIONS = (
+    "unique", "sparse", "expireAfterSeconds", "partialFilterExpression",
+)
+
+
+def get_generation_collections(db, names, generation=""):
+    """Get collections holding `names` in `generation` ('' stands for unsuffixed collections)"""
+    return {
+        name: db[name + "_" + generation if generation else name]
+        for name in names
+    }
+
+
+def get_active_generation(db, key):
+    """Look up which generation of collections under `key` readers should use"""
+    return (db.generations.find_one({"_id": key}) or {}).get("active", "")
+
+
+def copy_collection(source, target):
+    """Replace `target` with copy of `source`, including its indexes"""
+    target.drop()
+    if source.name in source.database.list_collection_names():
+        source.aggregate([{"$match": {}}, {"$out": target.name}])
+    for index_name, spec in source.index_information().items():
+        if index_name != "_id_":
+            target.create_index(spec["key"], name=index_name, **{
+                option: spec[option] for option in INDEX_OPTIONS
+                if option in spec
+            })
+
+
+def drop_generations(db, names, keep):
+    """Drop collections of generations of `names` other than those in `keep`"""
+    existing = set(db.list_collection_names())
+    for name in names:
+        for collection_name in existing:
+            if collection_name.startswith(name + "_gen"):
+                if collection_name[len(name)+1:] not in keep:
+                    db.drop_collection(collection_name)
+        if ("" not in keep) and (name in existing):
+            db.drop_collection(name)
+
+
+def stage_generation(db, key, names):
+    """Copy collections of active generation into collections of new generation; return new generation and its collections"""
+    entry = db.generations.find_one({"_id": key}) or {}
+    active, previous = entry.get("active", ""), entry.get("previous", "")
+    drop_generations(db, names, keep={active, previous}) # abandoned by crashes
+    generation = "gen" + uuid4().hex
+    source = get_generation_collections(db, names, active)
+    staged = get_generation_collections(db, names, generation)
+    for name in names:
+        copy_collection(source[name], staged[name])
+    return generation, staged
+
+
+def activate_generation(db, key, names, generation):
+    """Atomically point readers to `generation`; keep the one it replaces for readers still using it, drop older ones"""
+    entry = db.generations.find_one({"_id": key}) or {}
+    active = entry.get("active", "")
+    db.generations.update_one(
+        {"_id": key}, {"$set": {"active": generation, "previous": active}},
+        upsert=True,
+    )
+    drop_generations(db, names, keep={generation, active})
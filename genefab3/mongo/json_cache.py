@@ -0,0 +1,89 @@
+from genefab3.config import JSON_CACHE_COMPRESSION
+from genefab3.config import JSON_CACHE_COMPRESSION_LEVEL
+from genefab3.utils import canonical_json
+from genefab3.exceptions import GeneLabJSONException
+from genefab3.mongo.utils import iterate_batches
+from bson import Binary
+from pymongo import UpdateOne
+from json import loads
+from zlib import compress as zlib_compress, decompress as zlib_decompress
+try:
+    from zstandard import ZstdCompressor, ZstdDecompressor
+except ImportError:
+    ZstdCompressor, ZstdDecompressor = None, None
+
+
+def get_json_cache_compression(compression=JSON_CACHE_COMPRESSION):
+    """Resolve configured compression of cached JSONs; fall back from 'zstd' to 'zlib' if zstandard is not installed"""
+    if compression in {None, "zlib"}:
+        return compression
+    elif compression == "zstd":
+        return "zstd" if ZstdCompressor is not None else "zlib"
+    else:
+        msg = "Unsupported JSON cache compression: '{}'".format(compression)
+        raise ValueError(msg)
+
+
+def pack_raw_json(raw_json, compression=JSON_CACHE_COMPRESSION, level=JSON_CACHE_COMPRESSION_LEVEL):
+    """Get fields storing JSON in json_cache: as-is, or canonically serialized and compressed into binary"""
+    compression = get_json_cache_compression(compression)
+    if compression is None:
+        return {"raw": raw_json}
+    serialized = canonical_json(raw_json).encode()
+    if compression == "zstd":
+        compressed = ZstdCompressor(level=level).compress(serialized)
+    else:
+        compressed = zlib_compress(serialized, level)
+    return {"raw_compressed": Binary(compressed), "compression": compression}
+
+
+def can_unpack_raw_json(json_cache_entry):
+    """Check if JSON of json_cache entry can be decompressed in this process"""
+    compression = json_cache_entry.get("compression")
+    return (compression in {None, "zlib"}) or (
+        (compression == "zstd") and (ZstdDecompressor is not None)
+    )
+
+
+def unpack_raw_json(json_cache_entry):
+    """Get JSON from fields of json_cache entry, decompressing if needed"""
+    compression = json_cache_entry.get("compression")
+    if not can_unpack_raw_json(json_cache_entry):
+        msg = "Cannot decompress cached JSON ('{}')".format(compression)
+        raise GeneLabJSONException(msg)
+    elif compression is None:
+        return json_cache_entry["raw"]
+    elif compression == "zlib":
+        serialized = zlib_decompress(json_cache_entry["raw_compressed"])
+    else:
+        serialized = ZstdDecompressor().decompress(
+            json_cache_entry["raw_compressed"],
+        )
+    return loads(serialized.decode())
+
+
+def migrate_json_cache(db, compression=JSON_CACHE_COMPRESSION):
+    """Convert json_cache entries to configured `compression`; return number of converted entries"""
+    compression = get_json_cache_compression(compression)
+    if compression is None:
+        query = {"compression": {"$exists": True}}
+    else:
+        query = {"compression": {"$ne": compression}}
+    entries = db.json_cache.find(query, {
+        "raw": True, "raw_compressed": True, "compression": True,
+        "digest": True,
+    })
+    def iterate_conversions():
+        for entry in entries:
+            if not can_unpack_raw_json(entry): # replaced on next download
+                continue
+            fields = pack_raw_json(unpack_raw_json(entry), compression)
+            unset = {"raw", "raw_compressed", "compression"} - set(fields)
+            yield UpdateOne( # skipped if JSON was replaced since lookup
+                {"_id": entry["_id"], "digest": entry.get("digest")},
+                {"$set": fields, "$unset": dict.fromkeys(unset, "")},
+            )
+    return sum(
+        db.json_cache.bulk_write(batch, ordered=True).modified_count
+        for batch in iterate_batches(iterate_conversions())
+    )
@@ -0,0 +1,96 @@
+from sys import stderr
+from genefab3.config import CACHER_LEASE_TTL, CACHER_LEASE_HEARTBEAT_INTERVAL
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from socket import gethostname
+from os import getpid
+from uuid import uuid4
+from threading import Thread, Event
+from time import sleep
+
+
+def ensure_lease_indexes(db):
+    """Make sure expired lease documents get garbage-collected"""
+    db.leases.create_index("expires", expireAfterSeconds=0)
+
+
+class MongoLease():
+    """Named lock document with expiration date, held by at most one process cluster-wide"""
+ 
+    def __init__(self, db, name, ttl=CACHER_LEASE_TTL, heartbeat_interval=CACHER_LEASE_HEARTBEAT_INTERVAL):
+        """Describe lease (see also: ensure_lease_indexes)"""
+        self.collection, self.name = db.leases, name
+        self.ttl, self.heartbeat_interval = ttl, heartbeat_interval
+        self.holder = "{}:{}:{}".format(gethostname(), getpid(), uuid4().hex)
+        self.heartbeat, self.released = None, Event()
+        self.expires = None # as of last successful acquire()
+ 
+    def acquire(self):
+        """Take or extend lease if it is free, expired, or already held by self; return True if held"""
+        now = datetime.utcnow()
+        try:
+            self.collection.find_one_and_update(
+                {"_id": self.name, "$or": [
+                    {"holder": self.holder}, {"expires": {"$lt": now}},
+                ]},
+                {"$set": {
+                    "holder": self.holder,
+                    "expires": now + timedelta(seconds=self.ttl),
+                }},
+                upsert=True,
+            )
+        except DuplicateKeyError: # held by someone else, could not upsert
+            self.expires = None
+            return False
+        else:
+            self.expires = now + timedelta(seconds=self.ttl)
+            return True
+ 
+    def beat(self):
+        """Keep extending lease until released or lost"""
+        while not self.released.wait(self.heartbeat_interval):
+            try:
+                if not self.acquire():
+                    break
+            except Exception as e: # retry; lease lapses if errors persist
+                msg = "Warning: could not extend lease {} ({}: {})".format(
+                    self.name, type(e).__name__, e,
+                )
+                print(msg, file=stderr)
+ 
+    def is_held(self):
+        """Check if lease was extended by self and has not expired since"""
+        return (
+            (self.expires is not None) and (not self.released.is_set()) and
+            (datetime.utcnow() < self.expires)
+        )
+ 
+    def hold(self):
+        """Acquire lease and keep extending it in background; return True if held"""
+        if self.acquire():
+            if (self.heartbeat is None) or (not self.heartbeat.is_alive()):
+                self.released.clear()
+                self.heartbeat = Thread(target=self.beat, daemon=True)
+                self.heartbeat.start()
+            return True
+        else:
+            return False
+ 
+    def release(self):
+        """Stop extending lease and free it for other holders"""
+        self.released.set()
+        self.expires = None
+        self.collection.delete_one({"_id": self.name, "holder": self.holder})
+ 
+    def wait(self, timeout=None, poll_interval=.5):
+        """Wait until lease is free or expired; return True if it is"""
+        waited = 0
+        while self.collection.find_one({
+            "_id": self.name, "holder": {"$ne": self.holder},
+            "expires": {"$gte": datetime.utcnow()},
+        }):
+            if (timeout is not None) and (waited >= timeout):
+                return False
+            sleep(poll_interval)
+            waited += poll_interval
+        return True
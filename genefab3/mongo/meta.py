@@ -1,18 +1,56 @@
 from os import environ
 from sys import stderr
-from genefab3.config import COLD_SEARCH_MASK, MAX_JSON_AGE
+from genefab3.config import COLD_API_ROOT, MAX_JSON_AGE
+from genefab3.config import MAX_STALE_JSON_AGE, JSON_REVALIDATION_MAX_WORKERS
 from genefab3.config import CACHER_THREAD_CHECK_INTERVAL
 from genefab3.config import CACHER_THREAD_RECHECK_INTERVAL
+from genefab3.config import CACHER_THREAD_MAX_WORKERS
+from genefab3.config import METADATA_SHADOW_REFRESH
+from genefab3.config import REFRESH_QUEUE_POLL_INTERVAL
+from genefab3.config import SINGLEFLIGHT_ACROSS_PROCESSES
+from genefab3.config import SINGLEFLIGHT_LEASE_TTL
+from genefab3.config import DATASET_CACHE_MAX_ENTRIES, DATASET_CACHE_MAX_BYTES
 from genefab3.config import ASSAY_METADATALIKES
-from genefab3.utils import download_cold_json
-from genefab3.mongo.utils import replace_doc, insert_one_safe
-from genefab3.exceptions import GeneLabJSONException
+from genefab3.utils import download_cold_json, json_digest
+from genefab3.mongo.utils import replace_doc, make_safe_keys
+from genefab3.mongo.utils import insert_many_in_batches, bulk_write_in_batches
+from genefab3.mongo.utils import iterate_batches
+from genefab3.mongo.generations import get_generation_collections
+from genefab3.mongo.generations import get_active_generation
+from genefab3.mongo.generations import stage_generation, activate_generation
+from genefab3.exceptions import GeneLabException, GeneLabJSONException
+from genefab3.exceptions import GeneLabColdStorageException
 from genefab3.coldstorage.dataset import ColdStorageDataset
+from genefab3.mongo.lease import MongoLease, ensure_lease_indexes
+from genefab3.singleflight import SingleFlight
+from genefab3.coldstorage.client import COLD_STORAGE_CLIENT
+from genefab3.caching import LRUCache
+from genefab3.mongo.snapshots import load_dataset_snapshot
+from genefab3.mongo.snapshots import save_dataset_snapshot
+from genefab3.mongo.refresh_queue import ensure_refresh_queue_indexes
+from genefab3.mongo.refresh_queue import enqueue_refresh, enqueue_refreshes
+from genefab3.mongo.refresh_queue import claim_refresh, complete_refresh
+from genefab3.mongo.refresh_queue import release_refresh, force_refresh
+from genefab3.mongo.refresh_queue import has_pending_refreshes
+from genefab3.mongo.cold_search import ensure_cold_search_indexes
+from genefab3.mongo.cold_search import iterate_cold_search
+from genefab3.mongo.cold_search import drop_unseen_accessions
+from genefab3.mongo.json_cache import pack_raw_json, unpack_raw_json
+from genefab3.mongo.json_cache import can_unpack_raw_json
+from genefab3.mongo.json_cache import migrate_json_cache
+from genefab3.mongo.retention import ensure_cache_indexes, get_retention_date
+from genefab3.mongo.retention import retain_accessions
 from datetime import datetime
-from pymongo import DESCENDING
+from pymongo import ReplaceOne, DeleteMany, ASCENDING
 from pandas import Series
-from threading import Thread
-from time import sleep
+from threading import Thread, Lock
+from time import sleep, time
+from uuid import uuid4
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from collections import defaultdict
+from itertools import repeat
 
 
 DEBUG = (environ.get("FLASK_ENV", None) == "development")
@@ -28,12 +66,17 @@ def cacher_thread_log(message, error=False):
         print(print_mask.format(datetime.now(), message), file=stderr)
 
 
-def get_fresh_and_stale_accessions(db, max_age=MAX_JSON_AGE):
-    """Find accessions in no need / need of update in database"""
-    refresh_dates = Series({
+def get_refresh_dates(db):
+    """Find when each dataset was last refreshed"""
+    return Series({
         entry["accession"]: entry["last_refreshed"]
         for entry in db.dataset_timestamps.find()
     })
+
+
+def get_fresh_and_stale_accessions(db, max_age=MAX_JSON_AGE):
+    """Find accessions in no need / need of update in database"""
+    refresh_dates = get_refresh_dates(db)
     current_timestamp = int(datetime.now().timestamp())
     indexer = ((current_timestamp - refresh_dates) <= max_age)
     return set(refresh_dates[indexer].index), set(refresh_dates[~indexer].index)
@@ -41,7 +84,7 @@ def get_fresh_and_stale_accessions(db, max_age=MAX_JSON_AGE):
 
 def is_json_cache_fresh(json_cache_info, max_age=MAX_JSON_AGE):
     """Check if particular JSON cache is up to date"""
-    if (json_cache_info is None) or ("raw" not in json_cache_info):
+    if (json_cache_info is None) or ("digest" not in json_cache_info):
         return False
     else:
         current_timestamp = int(datetime.now().timestamp())
@@ -49,144 +92,559 @@ def is_json_cache_fresh(json_cache_info, max_age=MAX_JSON_AGE):
         return (current_timestamp - cache_timestamp <= max_age)
 
 
-def get_fresh_json(db, identifier, kind="other", max_age=MAX_JSON_AGE, compare=False):
-    """Get JSON from local database if fresh, otherwise update local database and get"""
+JSON_REVALIDATION_EXECUTOR = ThreadPoolExecutor(
+    max_workers=JSON_REVALIDATION_MAX_WORKERS,
+)
+JSON_REVALIDATIONS_IN_FLIGHT, JSON_REVALIDATIONS_LOCK = set(), Lock()
+
+
+def revalidate_json(db, identifier, kind, max_age):
+    """Update JSON in local database; if dataset JSON changed, have CacherThread prioritize its metadata"""
+    try:
+        _, json_changed = get_fresh_json(
+            db, identifier, kind, max_age, compare=True, load=False,
+        )
+        if (kind == "glds") and json_changed:
+            enqueue_refresh(db, identifier, on_demand=True)
+    finally:
+        with JSON_REVALIDATIONS_LOCK:
+            JSON_REVALIDATIONS_IN_FLIGHT.discard((identifier, kind))
+
+
+def schedule_json_revalidation(db, identifier, kind, max_age=MAX_JSON_AGE):
+    """Revalidate JSON in background, unless already being revalidated"""
+    with JSON_REVALIDATIONS_LOCK:
+        if (identifier, kind) in JSON_REVALIDATIONS_IN_FLIGHT:
+            return
+        else:
+            JSON_REVALIDATIONS_IN_FLIGHT.add((identifier, kind))
+    JSON_REVALIDATION_EXECUTOR.submit(
+        revalidate_json, db, identifier, kind, max_age,
+    )
+
+
+def get_json_cache_validators(json_cache_info):
+    """Get HTTP validators (ETag, Last-Modified) stored with JSON cache, if any"""
+    if (json_cache_info is None) or ("digest" not in json_cache_info):
+        return {}
+    else:
+        return {
+            k: json_cache_info[k] for k in ("etag", "last_modified")
+            if json_cache_info.get(k)
+        }
+
+
+def load_cached_json(db, json_cache_info, identifier):
+    """Retrieve raw JSON of cache entry that was looked up without it"""
+    try:
+        return unpack_raw_json(db.json_cache.find_one(
+            {"_id": json_cache_info["_id"]},
+            {"raw": True, "raw_compressed": True, "compression": True},
+        ))
+    except (TypeError, KeyError):
+        msg_mask = "Cannot retrieve cold storage JSON for '{}'"
+        raise GeneLabJSONException(msg_mask.format(identifier))
+
+
+def find_json_cache_info(db, identifier, kind):
+    """Look up JSON cache entry without its raw JSON"""
     json_cache_info = db.json_cache.find_one(
         {"identifier": identifier, "kind": kind},
-        sort=[("last_refreshed", DESCENDING)],
+        {"raw": False, "raw_compressed": False},
     )
-    if is_json_cache_fresh(json_cache_info, max_age):
-        fresh_json, json_changed = json_cache_info["raw"], False
+    if (json_cache_info is None) or can_unpack_raw_json(json_cache_info):
+        return json_cache_info
+    else: # missing as far as this process goes, download again
+        return None
+
+
+def update_json_cache(db, identifier, kind, max_age):
+    """Download JSON and store in local database, unless it has just been updated elsewhere"""
+    latest_json_cache_info = find_json_cache_info(db, identifier, kind)
+    if is_json_cache_fresh(latest_json_cache_info, max_age):
+        digest = latest_json_cache_info["digest"]
+        return None, digest, latest_json_cache_info
+    try:
+        fresh_json, validators = download_cold_json(
+            identifier, kind=kind,
+            validators=get_json_cache_validators(latest_json_cache_info),
+        )
+    except GeneLabColdStorageException: # cold storage host is unavailable
+        raise
+    except Exception:
+        msg_mask = "Cannot retrieve cold storage JSON for '{}'"
+        raise GeneLabJSONException(msg_mask.format(identifier))
+    if fresh_json is None: # not modified upstream, only mark as fresh
+        db.json_cache.update_one(
+            {"_id": latest_json_cache_info["_id"]}, {"$set": {
+                "last_refreshed": int(datetime.now().timestamp()),
+                "expires": get_retention_date(), **validators,
+            }},
+        )
+        digest = latest_json_cache_info["digest"]
+        return None, digest, latest_json_cache_info
     else:
-        try:
-            fresh_json = download_cold_json(identifier, kind=kind)
-        except Exception:
-            try:
-                fresh_json, json_changed = json_cache_info["raw"], False
-            except (TypeError, KeyError):
-                msg_mask = "Cannot retrieve cold storage JSON for '{}'"
-                raise GeneLabJSONException(msg_mask.format(identifier))
+        digest = json_digest(fresh_json)
+        replace_doc(
+            db.json_cache, {"identifier": identifier, "kind": kind},
+            last_refreshed=int(datetime.now().timestamp()),
+            expires=get_retention_date(), digest=digest,
+            **pack_raw_json(fresh_json), **validators,
+        )
+        return fresh_json, digest, None
+
+
+JSON_DOWNLOADS = SingleFlight()
+
+
+def get_fresh_json(db, identifier, kind="other", max_age=MAX_JSON_AGE, compare=False, load=True, stale_while_revalidate=False, max_stale_age=MAX_STALE_JSON_AGE, fall_back_to_cache=True):
+    """Get JSON from local database if fresh, otherwise update local database and get"""
+    json_cache_info = find_json_cache_info(db, identifier, kind)
+    can_be_served_stale = stale_while_revalidate and is_json_cache_fresh(
+        json_cache_info, max_stale_age,
+    )
+    if is_json_cache_fresh(json_cache_info, max_age):
+        fresh_json, json_changed = None, False
+    elif can_be_served_stale:
+        schedule_json_revalidation(db, identifier, kind, max_age)
+        fresh_json, json_changed = None, False
+    else: # concurrent callers with same requirements share one download:
+        if SINGLEFLIGHT_ACROSS_PROCESSES:
+            lease = MongoLease(
+                db, "SingleFlight:json_cache:{}:{}".format(kind, identifier),
+                ttl=SINGLEFLIGHT_LEASE_TTL,
+            )
         else:
-            replace_doc(
-                db.json_cache, {"identifier": identifier, "kind": kind},
-                last_refreshed=int(datetime.now().timestamp()), raw=fresh_json,
+            lease = None
+        previous_digest = (json_cache_info or {}).get("digest")
+        try:
+            fresh_json, digest, json_cache_info = JSON_DOWNLOADS.do(
+                (identifier, kind, max_age), update_json_cache,
+                db, identifier, kind, max_age, lease=lease,
             )
-            if compare and json_cache_info:
-                json_changed = (fresh_json != json_cache_info.get("raw", {}))
-            elif compare:
-                json_changed = True
+        except GeneLabException:
+            if (json_cache_info is None) or (not fall_back_to_cache):
+                raise
+            else: # serve cached copy; it stays due for revalidation
+                fresh_json, json_changed = None, False
+        else:
+            json_changed = (digest != previous_digest)
+    if load and (fresh_json is None):
+        fresh_json = load_cached_json(db, json_cache_info, identifier)
     if compare:
         return fresh_json, json_changed
     else:
         return fresh_json
 
 
-def refresh_dataset_json_store(db, accession):
-    """Refresh top-level JSON of dataset in database"""
-    glds_json, glds_changed = get_fresh_json(
-        db, accession, "glds", compare=True,
+def refresh_dataset_json_store(db, accession, load=True, stale_while_revalidate=False, fall_back_to_cache=True):
+    """Refresh top-level JSON of dataset in database (see get_fresh_json() for arguments)"""
+    return get_fresh_json(
+        db, accession, "glds", compare=True, load=load,
+        stale_while_revalidate=stale_while_revalidate,
+        fall_back_to_cache=fall_back_to_cache,
     )
+
+
+def mark_dataset_refreshed(db, accession):
+    """Record when top-level JSON of dataset was last downloaded or revalidated"""
+    json_cache_info = find_json_cache_info(db, accession, "glds") or {}
     replace_doc(
         db.dataset_timestamps, {"accession": accession},
-        last_refreshed=int(datetime.now().timestamp()),
+        last_refreshed=json_cache_info.get(
+            "last_refreshed", int(datetime.now().timestamp()),
+        ),
+        expires=get_retention_date(),
     )
-    return glds_json, glds_changed
 
 
-def get_dataset_with_caching(db, accession):
-    """Refresh dataset JSONs in database"""
-    glds_json, _ = refresh_dataset_json_store(db, accession)
-    fileurls_json = get_fresh_json(db, accession, "fileurls")
+DATASET_CACHE = LRUCache(
+    max_entries=DATASET_CACHE_MAX_ENTRIES, max_bytes=DATASET_CACHE_MAX_BYTES,
+    sizeof=ColdStorageDataset.memory_usage,
+)
+
+
+def get_json_digest(db, identifier, kind):
+    """Look up digest of cached JSON"""
+    return (find_json_cache_info(db, identifier, kind) or {}).get("digest")
+
+
+def load_dataset(db, accession, on_demand=False):
+    """Refresh dataset JSONs in database, initialize dataset or reuse one parsed from same JSONs (from memory or from snapshot)"""
+    _, glds_changed = refresh_dataset_json_store(
+        db, accession, load=False, stale_while_revalidate=on_demand,
+    )
+    if on_demand and glds_changed:
+        enqueue_refresh(db, accession, on_demand=True)
+    get_json = partial(get_fresh_json, stale_while_revalidate=on_demand)
+    get_json(db, accession, "fileurls", load=False)
     # internal _id is only found through dataset JSON, but may be cached:
     _id_search = db.accession_to_id.find_one({"accession": accession})
     if (_id_search is None) or ("cold_id" not in _id_search):
         # internal _id not cached, initialize dataset to find it:
         glds = ColdStorageDataset(
-            accession, glds_json, fileurls_json, filedates_json=None,
+            accession, get_json(db, accession, "glds"),
+            get_json(db, accession, "fileurls"), filedates_json=None,
         )
+        cold_id = glds.isa._id
         replace_doc(
-            db.accession_to_id, {"accession": accession}, cold_id=glds.isa._id,
+            db.accession_to_id, {"accession": accession}, cold_id=cold_id,
+            expires=get_retention_date(),
         )
-        filedates_json = get_fresh_json(db, glds.isa._id, "filedates")
     else:
-        filedates_json = get_fresh_json(db, _id_search["cold_id"], "filedates")
-        glds = ColdStorageDataset(
-            accession, glds_json, fileurls_json, filedates_json,
-        )
+        glds, cold_id = None, _id_search["cold_id"]
+    get_json(db, cold_id, "filedates", load=False)
+    version = (
+        get_json_digest(db, accession, "glds"),
+        get_json_digest(db, accession, "fileurls"),
+        get_json_digest(db, cold_id, "filedates"),
+    )
+    if glds is None:
+        cached_glds = DATASET_CACHE.get(accession, version)
+        if cached_glds is not None:
+            return cached_glds
+        glds = load_dataset_snapshot(db, accession, version)
+        if glds is None:
+            glds = ColdStorageDataset(
+                accession, get_json(db, accession, "glds"),
+                get_json(db, accession, "fileurls"),
+                get_json(db, cold_id, "filedates"),
+            )
+            save_dataset_snapshot(db, glds, version)
+    else:
+        save_dataset_snapshot(db, glds, version)
+    DATASET_CACHE.put(accession, glds, version)
     return glds
 
 
-def refresh_assay_meta_stores(db, accession):
-    """Put per-sample, per-assay factors, annotation, and metadata into database"""
+DATASET_LOADS = SingleFlight()
+
+
+def get_dataset_with_caching(db, accession, on_demand=False):
+    """Refresh dataset JSONs in database, initialize dataset once for concurrent callers"""
+    return DATASET_LOADS.do(
+        (accession, on_demand), load_dataset, db, accession, on_demand,
+    )
+
+
+def iterate_metadatalike_documents(dataframe, accession, assay_name):
+    """Convert MetadataLike.named to per-sample documents, collecting values of same-named fields into lists"""
+    positions = defaultdict(list)
+    for i, field in enumerate(dataframe.columns):
+        positions[field].append(i)
+    safe_keys = make_safe_keys(
+        ["accession", "assay name", "sample name", *positions],
+    )
+    values = dataframe.values
+    if positions:
+        value_lists = zip(*(values[:, p].tolist() for p in positions.values()))
+    else:
+        value_lists = repeat((), len(dataframe))
+    for sample_name, sample_value_lists in zip(dataframe.index, value_lists):
+        yield dict(zip(
+            safe_keys,
+            [accession, assay_name, sample_name, *sample_value_lists],
+        ))
+
+
+META_GENERATIONS_KEY = "metadata"
+META_STORE_NAMES = [*ASSAY_METADATALIKES, "metadata_fingerprints"]
+
+
+def get_meta_stores(db):
+    """Get collections for metadata (and their fingerprints) of generation currently served to readers"""
+    return get_generation_collections(
+        db, META_STORE_NAMES, get_active_generation(db, META_GENERATIONS_KEY),
+    )
+
+
+def ensure_meta_store_indexes(db):
+    """Index per-sample metadata and fingerprints by assay and sample"""
+    stores = get_meta_stores(db)
+    for meta in ASSAY_METADATALIKES:
+        stores[meta].create_index([
+            ("accession", ASCENDING), ("assay name", ASCENDING),
+            ("sample name", ASCENDING),
+        ])
+    stores["metadata_fingerprints"].create_index([
+        ("accession", ASCENDING), ("assay name", ASCENDING),
+        ("meta", ASCENDING),
+    ])
+
+
+def refresh_assay_meta_store(stores, meta, assay):
+    """Put per-sample metadata of one meta of one assay into database, only where changed"""
+    collection = stores[meta]
+    accession, assay_name = assay.dataset.accession, assay.name
+    assay_query = {"accession": accession, "assay name": assay_name}
+    dataframe = getattr(assay, meta).named
+    documents = list(iterate_metadatalike_documents(
+        dataframe, accession, assay_name,
+    ))
+    sample_digests = dict(zip(
+        dataframe.index, (json_digest(document) for document in documents),
+    ))
+    digest = json_digest(sorted(sample_digests.items()))
+    fingerprint_query = {**assay_query, "meta": meta}
+    fingerprint = stores["metadata_fingerprints"].find_one(fingerprint_query)
+    if fingerprint and (fingerprint.get("digest") == digest):
+        return False
+    elif (not fingerprint) or (len(sample_digests) != len(documents)):
+        # no prior knowledge of stored samples, or ambiguous sample names:
+        collection.delete_many(assay_query)
+        insert_many_in_batches(collection, documents)
+    else:
+        previous_digests = dict(fingerprint.get("samples", []))
+        operations = []
+        removed_sample_names = list(set(previous_digests) - set(sample_digests))
+        if removed_sample_names:
+            operations.append(DeleteMany({
+                **assay_query, "sample name": {"$in": removed_sample_names},
+            }))
+        for sample_name, document in zip(dataframe.index, documents):
+            # upsert new samples too, so that retries after failures are safe:
+            if previous_digests.get(sample_name) != sample_digests[sample_name]:
+                operations.append(ReplaceOne(
+                    {**assay_query, "sample name": sample_name}, document,
+                    upsert=True,
+                ))
+        bulk_write_in_batches(collection, operations)
+    replace_doc(
+        stores["metadata_fingerprints"], fingerprint_query,
+        digest=digest, samples=[[sn, d] for sn, d in sample_digests.items()],
+    )
+    return True
+
+
+def drop_removed_assays_from_meta_stores(stores, glds):
+    """Remove metadata of assays no longer present in dataset from database"""
+    removed_assay_query = {
+        "accession": glds.accession, "assay name": {"$nin": list(glds.assays)},
+    }
+    if stores["metadata_fingerprints"].find_one(removed_assay_query):
+        for meta in ASSAY_METADATALIKES:
+            stores[meta].delete_many(removed_assay_query)
+        stores["metadata_fingerprints"].delete_many(removed_assay_query)
+
+
+def refresh_assay_meta_stores(db, accession, stores=None):
+    """Put per-sample, per-assay factors, annotation, and metadata into database (or `stores`), only where changed"""
+    if stores is None:
+        stores = get_meta_stores(db)
     glds = get_dataset_with_caching(db, accession)
+    updated_slices = []
     for assay in glds.assays.values():
         for meta in ASSAY_METADATALIKES:
-            collection = getattr(db, meta)
-            dataframe = getattr(assay, meta).named
-            collection.delete_many({
-                "accession": assay.dataset.accession, "assay name": assay.name,
-            })
-            for sample_name, row in dataframe.iterrows():
-                insert_one_safe(collection, {
-                    **{
-                        "accession": assay.dataset.accession,
-                        "assay name": assay.name, "sample name": sample_name,
-                    },
-                    **row.groupby(row.index).aggregate(list).to_dict(),
-                })
-
-
-def refresh_database_metadata_for_some_datasets(db, accessions):
-    """Put updated JSONs for datasets with {accessions} and their assays into database"""
-    datasets_with_updated_assays = []
-    for accession in accessions:
-        _, glds_changed = refresh_dataset_json_store(db, accession)
+            if refresh_assay_meta_store(stores, meta, assay):
+                updated_slices.append((assay.name, meta))
+    drop_removed_assays_from_meta_stores(stores, glds)
+    return updated_slices
+
+
+def refresh_database_metadata_for_one_dataset(db, accession, stores=None, force=False):
+    """Put updated JSONs for dataset with {accession} and its assays into database, report outcome"""
+    report = Namespace(
+        accession=accession, changed=False, updated_slices=[], error=None,
+    )
+    try:
+        _, report.changed = refresh_dataset_json_store(
+            db, accession, load=False, fall_back_to_cache=False,
+        )
+        # without fallback, JSON here is either fresh or was just fetched:
+        mark_dataset_refreshed(db, accession)
         cacher_thread_log("Refreshed JSON for dataset {}".format(accession))
-        if glds_changed:
+        if force or report.changed:
             cacher_thread_log("JSON changed for dataset {}".format(accession))
-            datasets_with_updated_assays.append(accession)
-            refresh_assay_meta_stores(db, accession)
+            report.updated_slices = refresh_assay_meta_stores(
+                db, accession, stores,
+            )
             cacher_thread_log(
-                "Refreshed JSON for assays in {}".format(accession),
+                "Refreshed JSON for assays in {} ({} metas changed)".format(
+                    accession, len(report.updated_slices),
+                ),
             )
-    return datasets_with_updated_assays
+    except GeneLabColdStorageException: # keep queue intact, stop refreshing
+        raise
+    except Exception as e:
+        report.error = "{}: {}".format(type(e).__name__, e)
+        cacher_thread_log(
+            "Could not refresh dataset {}: {}".format(accession, report.error),
+            error=True,
+        )
+    return report
 
 
-def refresh_database_metadata(db):
-    """Iterate over datasets in cold storage, put updated JSONs into database"""
-    fresh, stale = get_fresh_and_stale_accessions(db)
-    try: # get number of datasets in database, and then all dataset JSONs
-        url_n = COLD_SEARCH_MASK.format(0)
-        n_datasets = get_fresh_json(db, url_n)["hits"]["total"]
-        url_all = COLD_SEARCH_MASK.format(n_datasets)
-        raw_datasets_json = get_fresh_json(db, url_all)["hits"]["hits"]
-        all_accessions = {raw_json["_id"] for raw_json in raw_datasets_json}
-    except KeyError:
-        cacher_thread_log(
-            "Cold storage returned malformed search JSON", error=True,
+def refresh_queued_datasets(db, shadow=METADATA_SHADOW_REFRESH, max_workers=CACHER_THREAD_MAX_WORKERS, lease=None):
+    """Refresh datasets from refresh queue, most requested and most stale first"""
+    if shadow:
+        if not has_pending_refreshes(db): # nothing to stage a generation for
+            return {}
+        generation, stores = stage_generation(
+            db, META_GENERATIONS_KEY, META_STORE_NAMES,
         )
     else:
-        updated_assays = refresh_database_metadata_for_some_datasets(
-            db, all_accessions - fresh,
-        )
-        for accession in (fresh | stale) - all_accessions:
-            # drop removed datasets:
-            db.dataset_timestamps.delete_many({"accession": accession})
-            db.accession_to_id.delete_many({"accession": accession})
-        return all_accessions, fresh, stale, updated_assays
+        stores = get_meta_stores(db)
+    claimant, held = uuid4().hex, []
+    def refresh_until_queue_is_empty():
+        reports = []
+        while True:
+            if (lease is not None) and (not lease.is_held()):
+                return reports # another CacherThread may be refreshing now
+            entry = claim_refresh(db, claimant)
+            if entry is None:
+                return reports
+            try:
+                report = refresh_database_metadata_for_one_dataset(
+                    db, entry["accession"], stores, force=entry.get("force"),
+                )
+            except BaseException:
+                release_refresh(db, entry)
+                raise
+            reports.append(report)
+            if not shadow:
+                complete_refresh(db, entry)
+            else: # keep until swap; if it never happens, recheck metadata
+                if report.changed or report.updated_slices:
+                    force_refresh(db, entry)
+                held.append(entry)
+    activated = False
+    try:
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            futures = [
+                executor.submit(refresh_until_queue_is_empty)
+                for _ in range(max(max_workers, 1))
+            ]
+            reports = [
+                report for future in futures for report in future.result()
+            ]
+        if shadow and any(report.updated_slices for report in reports):
+            activate_generation(
+                db, META_GENERATIONS_KEY, META_STORE_NAMES, generation,
+            )
+            activated = True
+    except BaseException:
+        for entry in held:
+            release_refresh(db, entry)
+        raise
+    finally:
+        if shadow and (not activated):
+            for collection in stores.values():
+                collection.drop()
+    for entry in held:
+        complete_refresh(db, entry)
+    return {report.accession: report for report in reports}
+
+
+def refresh_database_metadata_for_some_datasets(db, accessions, shadow=METADATA_SHADOW_REFRESH, max_workers=CACHER_THREAD_MAX_WORKERS):
+    """Put updated JSONs for datasets with {accessions} and their assays into database, most stale first"""
+    refresh_dates = get_refresh_dates(db)
+    enqueue_refreshes(db, {
+        accession: int(refresh_dates.get(accession, -1))
+        for accession in accessions
+    })
+    return refresh_queued_datasets(db, shadow, max_workers)
+
+
+def expire_cached_jsons(db, identifiers, kind="other"):
+    """Mark cached JSONs as due for revalidation"""
+    db.json_cache.update_many(
+        {"identifier": {"$in": list(identifiers)}, "kind": kind},
+        {"$set": {"last_refreshed": -1}},
+    )
+
+
+def refresh_database_metadata(db, shadow=METADATA_SHADOW_REFRESH, lease=None):
+    """Queue new, stale and changed datasets found in cold storage and put their updated JSONs into database"""
+    fresh, stale = get_fresh_and_stale_accessions(db)
+    refresh_dates = get_refresh_dates(db)
+    seen_at = int(datetime.now().timestamp())
+    all_accessions = set()
+    for batch in iterate_batches(iterate_cold_search(db, seen_at)):
+        changed = {a for a, hit_changed in batch if hit_changed} & fresh
+        expire_cached_jsons(db, changed, kind="glds")
+        enqueue_refreshes(db, {
+            accession: int(refresh_dates.get(accession, -1))
+            for accession, _ in batch
+            if (accession not in fresh) or (accession in changed)
+        })
+        retain_accessions(db, (accession for accession, _ in batch))
+        all_accessions.update(accession for accession, _ in batch)
+    reports = refresh_queued_datasets(db, shadow=shadow, lease=lease)
+    drop_unseen_accessions(db, seen_at)
+    return all_accessions, fresh, stale, reports
 
 
 class CacherThread(Thread):
     """Lives in background and keeps local metadata cache up to date"""
-    def __init__(self, db, check_interval=CACHER_THREAD_CHECK_INTERVAL, recheck_interval=CACHER_THREAD_RECHECK_INTERVAL):
+    def __init__(self, db, check_interval=CACHER_THREAD_CHECK_INTERVAL, recheck_interval=CACHER_THREAD_RECHECK_INTERVAL, lease=True):
         self.db, self.check_interval = db, check_interval
         self.recheck_interval = recheck_interval
+        self.lease = MongoLease(db, "CacherThread") if lease else None
+        self.cache_indexes_ensured, self.json_cache_migrated = False, False
+        self.cold_storage_breaker = COLD_STORAGE_CLIENT.get_breaker(
+            COLD_API_ROOT,
+        )
+        ensure_lease_indexes(db)
+        ensure_refresh_queue_indexes(db)
+        ensure_cold_search_indexes(db)
         super().__init__()
+    def idle(self, seconds, poll_interval=REFRESH_QUEUE_POLL_INTERVAL):
+        """Sleep for `seconds`, meanwhile refreshing datasets enqueued on demand"""
+        wake_up_time = time() + seconds
+        while time() < wake_up_time:
+            sleep(max(0, min(poll_interval, wake_up_time - time())))
+            if self.cold_storage_breaker.seconds_until_probe() > 0:
+                continue # keep queue intact until cold storage recovers
+            try:
+                if has_pending_refreshes(self.db):
+                    reports = refresh_queued_datasets(
+                        self.db, shadow=False, lease=self.lease,
+                    )
+                    for accession in reports:
+                        cacher_thread_log("Refreshed {} on demand".format(
+                            accession,
+                        ))
+            except Exception as e:
+                cacher_thread_log("{}".format(e), error=True)
     def run(self):
         while True:
+            if (self.lease is not None) and (not self.lease.hold()):
+                cacher_thread_log(
+                    "Another CacherThread is active, will check after {} "
+                    "seconds".format(self.recheck_interval),
+                )
+                sleep(self.recheck_interval)
+                continue
+            unavailable_for = self.cold_storage_breaker.seconds_until_probe()
+            if unavailable_for > 0:
+                cacher_thread_log(
+                    "Cold storage unavailable, will check after {:.0f} "
+                    "seconds".format(unavailable_for),
+                )
+                sleep(unavailable_for)
+                continue
+            if not self.cache_indexes_ensured: # only by lease holder
+                try:
+                    ensure_cache_indexes(self.db)
+                    ensure_meta_store_indexes(self.db)
+                except Exception as e:
+                    cacher_thread_log("{}".format(e), error=True)
+                else:
+                    self.cache_indexes_ensured = True
+            if not self.json_cache_migrated:
+                try:
+                    cacher_thread_log("Converted {} cached JSONs".format(
+                        migrate_json_cache(self.db),
+                    ))
+                except Exception as e:
+                    cacher_thread_log("{}".format(e), error=True)
+                else:
+                    self.json_cache_migrated = True
             cacher_thread_log("Checking cache")
             try:
-                accessions, fresh, stale, _ = refresh_database_metadata(self.db)
+                accessions, fresh, stale, reports = refresh_database_metadata(
+                    self.db, lease=self.lease,
+                )
             except Exception as e:
                 cacher_thread_log("{}".format(e), error=True)
                 cacher_thread_log("Will try again after {} seconds".format(
@@ -197,7 +655,11 @@ class CacherThread(Thread):
                 cacher_thread_log("{} fresh, {} stale accessions".format(
                     len(fresh), len(stale),
                 ))
+                cacher_thread_log("{} updated, {} failed datasets".format(
+                    sum(report.changed for report in reports.values()),
+                    sum(bool(report.error) for report in reports.values()),
+                ))
                 cacher_thread_log("Will now sleep for {} seconds".format(
                     self.check_interval
                 ))
-                sleep(self.check_interval)
+                self.idle(self.check_interval)
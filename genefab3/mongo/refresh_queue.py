@@ -0,0 +1,99 @@
+from genefab3.config import REFRESH_QUEUE_CLAIM_TIMEOUT
+from genefab3.mongo.utils import bulk_write_in_batches
+from pymongo import UpdateOne, ASCENDING, DESCENDING, ReturnDocument
+from datetime import datetime
+
+
+def ensure_refresh_queue_indexes(db):
+    """Make sure each dataset is queued at most once and the most urgent entry is found fast"""
+    db.refresh_queue.create_index("accession", unique=True)
+    db.refresh_queue.create_index([
+        ("claimed_at", ASCENDING), ("requests", DESCENDING),
+        ("last_refreshed", ASCENDING),
+    ])
+
+
+def make_enqueue_operation(accession, on_demand=False, last_refreshed=None):
+    """Make upsert operation that queues dataset once and bumps its generation"""
+    update = {
+        "$setOnInsert": {
+            "enqueued": int(datetime.now().timestamp()), "claimed_at": None,
+        },
+        "$inc": {"requests": int(on_demand), "generation": 1},
+    }
+    if last_refreshed is None:
+        update["$setOnInsert"]["last_refreshed"] = -1
+    else:
+        update["$min"] = {"last_refreshed": last_refreshed}
+    if on_demand: # raise priority (above) and recheck metadata
+        update["$set"] = {"force": True}
+    else:
+        update["$setOnInsert"]["force"] = False
+    return UpdateOne({"accession": accession}, update, upsert=True)
+
+
+def enqueue_refresh(db, accession, on_demand=False, last_refreshed=None):
+    """Add dataset to refresh queue, or mark queued (or in flight) entry as requested again"""
+    operation = make_enqueue_operation(accession, on_demand, last_refreshed)
+    db.refresh_queue.bulk_write([operation])
+
+
+def enqueue_refreshes(db, last_refreshed_by_accession):
+    """Add datasets to refresh queue, prioritized by staleness"""
+    bulk_write_in_batches(db.refresh_queue, (
+        make_enqueue_operation(accession, last_refreshed=last_refreshed)
+        for accession, last_refreshed in last_refreshed_by_accession.items()
+    ))
+
+
+def make_claimable_query(current_timestamp, claim_timeout=REFRESH_QUEUE_CLAIM_TIMEOUT):
+    """Make query matching unclaimed (or abandoned) queue entries"""
+    return {"$or": [
+        {"claimed_at": None},
+        {"claimed_at": {"$lt": current_timestamp - claim_timeout}},
+    ]}
+
+
+def claim_refresh(db, claimant, claim_timeout=REFRESH_QUEUE_CLAIM_TIMEOUT):
+    """Atomically claim most requested, then most stale, unclaimed (or abandoned) queue entry; return entry or None"""
+    current_timestamp = int(datetime.now().timestamp())
+    return db.refresh_queue.find_one_and_update(
+        make_claimable_query(current_timestamp, claim_timeout),
+        {"$set": {"claimed_by": claimant, "claimed_at": current_timestamp}},
+        sort=[("requests", DESCENDING), ("last_refreshed", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def complete_refresh(db, entry):
+    """Remove claimed entry from queue, unless it was enqueued again while in flight; in that case, return it to queue"""
+    result = db.refresh_queue.delete_one({
+        "accession": entry["accession"], "claimed_by": entry["claimed_by"],
+        "generation": entry.get("generation"),
+    })
+    if result.deleted_count == 0:
+        release_refresh(db, entry)
+
+
+def release_refresh(db, entry):
+    """Return claimed entry to queue, to be claimed again"""
+    db.refresh_queue.update_one(
+        {"accession": entry["accession"], "claimed_by": entry["claimed_by"]},
+        {"$set": {"claimed_at": None}, "$unset": {"claimed_by": ""}},
+    )
+
+
+def force_refresh(db, entry):
+    """Have metadata of claimed entry rechecked if it is ever claimed again, e.g. after a crash"""
+    db.refresh_queue.update_one(
+        {"accession": entry["accession"], "claimed_by": entry["claimed_by"]},
+        {"$set": {"force": True}},
+    )
+
+
+def has_pending_refreshes(db, claim_timeout=REFRESH_QUEUE_CLAIM_TIMEOUT):
+    """Check if there are unclaimed (or abandoned) entries in refresh queue"""
+    current_timestamp = int(datetime.now().timestamp())
+    return db.refresh_queue.find_one(
+        make_claimable_query(current_timestamp, claim_timeout),
+    ) is not None
@@ -0,0 +1,49 @@
+from genefab3.config import CACHE_RETENTION
+from genefab3.mongo.utils import ensure_unique_index
+from datetime import datetime, timedelta
+
+
+DATASET_CACHE_COLLECTIONS = {
+    "dataset_timestamps": "last_refreshed", "accession_to_id": None,
+    "dataset_snapshots": None,
+}
+
+
+def get_retention_date(retention=CACHE_RETENTION):
+    """Get date until which cache entry is kept unless its dataset is seen in cold storage again"""
+    return datetime.utcnow() + timedelta(seconds=retention)
+
+
+def ensure_cache_indexes(db):
+    """Make sure there is one cache entry per JSON and per dataset, and that entries past their retention date get garbage-collected"""
+    ensure_unique_index(
+        db.json_cache, ["identifier", "kind"], newest_first="last_refreshed",
+    )
+    for name, newest_first in DATASET_CACHE_COLLECTIONS.items():
+        ensure_unique_index(getattr(db, name), ["accession"], newest_first)
+    for name in ["json_cache", *DATASET_CACHE_COLLECTIONS]:
+        collection = getattr(db, name)
+        collection.create_index("expires", expireAfterSeconds=0)
+        collection.update_many( # entries cached by earlier versions
+            {"expires": {"$exists": False}},
+            {"$set": {"expires": get_retention_date()}},
+        )
+
+
+def retain_accessions(db, accessions, expires=None):
+    """Push back retention date of cache entries of datasets still present in cold storage"""
+    accessions = list(accessions)
+    update = {"$set": {"expires": expires or get_retention_date()}}
+    cold_ids = [
+        entry["cold_id"] for entry in db.accession_to_id.find(
+            {"accession": {"$in": accessions}, "cold_id": {"$exists": True}},
+            {"cold_id": True},
+        )
+    ]
+    db.json_cache.update_many(
+        {"identifier": {"$in": accessions + cold_ids}}, update,
+    )
+    for name in DATASET_CACHE_COLLECTIONS:
+        getattr(db, name).update_many(
+            {"accession": {"$in": accessions}}, update,
+        )
@@ -0,0 +1,48 @@
+from sys import stderr
+from genefab3.config import DATASET_SNAPSHOT_MAX_BYTES
+from genefab3.coldstorage.snapshot import serialize_dataset, deserialize_dataset
+from genefab3.coldstorage.snapshot import SNAPSHOT_FORMAT
+from genefab3.mongo.utils import replace_doc
+from genefab3.mongo.retention import get_retention_date
+from bson import Binary
+
+
+def get_snapshot_version(json_digests):
+    """Tie snapshot to JSONs it was parsed from and to the code that can read it"""
+    return [SNAPSHOT_FORMAT, *json_digests]
+
+
+def load_dataset_snapshot(db, accession, json_digests):
+    """Rehydrate dataset from snapshot in database, if one exists for same JSONs; drop snapshot that cannot be read"""
+    entry = db.dataset_snapshots.find_one({
+        "accession": accession, "version": get_snapshot_version(json_digests),
+    })
+    if entry is None:
+        return None
+    try:
+        return deserialize_dataset(entry["snapshot"])
+    except Exception as e:
+        msg = "Warning: dropping unreadable snapshot of {} ({}: {})".format(
+            accession, type(e).__name__, e,
+        )
+        print(msg, file=stderr)
+        db.dataset_snapshots.delete_one({"_id": entry["_id"]})
+        return None
+
+
+def save_dataset_snapshot(db, glds, json_digests, max_bytes=DATASET_SNAPSHOT_MAX_BYTES):
+    """Store snapshot of parsed dataset in database, unless it is too large for one document or has fields that cannot be stored"""
+    try:
+        snapshot = serialize_dataset(glds)
+    except (TypeError, ValueError) as e:
+        msg = "Warning: not storing snapshot of {} ({}: {})".format(
+            glds.accession, type(e).__name__, e,
+        )
+        print(msg, file=stderr)
+        return
+    if len(snapshot) <= max_bytes:
+        replace_doc(
+            db.dataset_snapshots, {"accession": glds.accession},
+            version=get_snapshot_version(json_digests),
+            snapshot=Binary(snapshot), expires=get_retention_date(),
+        )
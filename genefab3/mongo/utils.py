@@ -1,25 +1,105 @@
 from bson import Code
 from bson.errors import InvalidDocument as InvalidDocumentError
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import ServerSelectionTimeoutError, DuplicateKeyError
+from genefab3.exceptions import GeneLabDatabaseException
+from genefab3.config import MONGO_DB_NAME, MONGO_INSERT_BATCH_SIZE
+from itertools import islice
+
+
+def get_database(db_name=MONGO_DB_NAME, timeout=2000):
+    """Connect to MongoDB server and return database"""
+    mongo = MongoClient(serverSelectionTimeoutMS=timeout)
+    try:
+        mongo.server_info()
+    except ServerSelectionTimeoutError:
+        msg = "Could not connect (sensitive info hidden)"
+        raise GeneLabDatabaseException(msg)
+    else:
+        return getattr(mongo, db_name)
+
+
+def make_safe_key(key):
+    """Modify dangerous key ('_id', key containing '$' and '.')"""
+    safe_key = key.replace("$", "_").replace(".", "_")
+    if safe_key == "_id":
+        return "__id"
+    else:
+        return safe_key
+
+
+def make_safe_keys(keys):
+    """Modify dangerous keys, making sure safe keys do not conflict"""
+    safe_keys = [make_safe_key(k) for k in keys]
+    if len(set(safe_keys)) != len(safe_keys):
+        raise InvalidDocumentError("Safe keys conflict")
+    else:
+        return safe_keys
 
 
 def insert_one_safe(collection, query):
     """Insert key-value pairs, modifying dangerous keys ('_id', keys containing '$' and '.')"""
-    safe_query = {}
-    for k, v in query.items():
-        safe_key = k.replace("$", "_").replace(".", "_")
-        if safe_key == "_id":
-            safe_key = "__id"
-        if safe_key not in safe_query:
-            safe_query[safe_key] = v
+    safe_keys = make_safe_keys(query.keys())
+    collection.insert_one(dict(zip(safe_keys, query.values())))
+
+
+def iterate_batches(iterable, batch_size=MONGO_INSERT_BATCH_SIZE):
+    """Split iterable into lists of up to `batch_size` elements"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if batch:
+            yield batch
         else:
-            raise InvalidDocumentError("Safe keys conflict")
-    collection.insert_one(safe_query)
+            break
+
+
+def insert_many_in_batches(collection, documents, batch_size=MONGO_INSERT_BATCH_SIZE):
+    """Insert documents (already with safe keys) from iterable in batches of `batch_size`"""
+    for batch in iterate_batches(documents, batch_size):
+        collection.insert_many(batch, ordered=False)
+
+
+def bulk_write_in_batches(collection, operations, batch_size=MONGO_INSERT_BATCH_SIZE):
+    """Perform write operations from iterable in batches of `batch_size`"""
+    for batch in iterate_batches(operations, batch_size):
+        collection.bulk_write(batch, ordered=True)
 
 
 def replace_doc(collection, query, **kwargs):
-    """Shortcut to drop all instances and replace with updated instance"""
-    collection.delete_many(query)
-    insert_one_safe(collection, {**query, **kwargs})
+    """Atomically replace document matching `query` with updated instance, or insert it if there is none (modifying dangerous keys)"""
+    document = {**query, **kwargs}
+    document = dict(zip(make_safe_keys(document.keys()), document.values()))
+    try:
+        collection.replace_one(query, document, upsert=True)
+    except DuplicateKeyError: # concurrent upsert inserted it first
+        collection.replace_one(query, document)
+
+
+def ensure_unique_index(collection, keys, newest_first=None, attempts=3):
+    """Drop duplicate documents, keeping the newest one (if `newest_first`), and index `keys` as unique"""
+    pipeline = [{"$project": dict.fromkeys([*keys, newest_first or "_id"], 1)}]
+    if newest_first:
+        pipeline.append({"$sort": {newest_first: DESCENDING}})
+    pipeline.extend([
+        {"$group": {
+            "_id": {key: "$" + key for key in keys},
+            "ids": {"$push": "$_id"},
+        }},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ])
+    for attempt in range(attempts): # other writers may insert duplicates
+        for duplicates in collection.aggregate(pipeline, allowDiskUse=True):
+            collection.delete_many({"_id": {"$in": duplicates["ids"][1:]}})
+        try:
+            collection.create_index(
+                [(key, ASCENDING) for key in keys], unique=True,
+            )
+        except DuplicateKeyError:
+            if attempt == attempts - 1:
+                raise
+        else:
+            break
 
 
 def get_collection_fields(collection, skip=set()):
@@ -0,0 +1,38 @@
+from argparse import Namespace
+from threading import Lock, Event
+
+
+class SingleFlight():
+    """Runs at most one call per key at a time, concurrent callers with same key share its outcome"""
+ 
+    def __init__(self):
+        """Initialize registry of calls in flight"""
+        self.calls, self.lock = {}, Lock()
+ 
+    def do(self, key, function, *args, lease=None, **kwargs):
+        """Call `function`, or wait for same-keyed call in flight and share its outcome"""
+        with self.lock:
+            call, is_leader = self.calls.get(key), False
+            if call is None:
+                call, is_leader = Namespace(done=Event(), error=None), True
+                self.calls[key] = call
+        if is_leader:
+            try:
+                if (lease is not None) and (not lease.acquire()):
+                    lease.wait(timeout=lease.ttl)
+                call.result = function(*args, **kwargs)
+            except Exception as e:
+                call.error = e
+            finally:
+                if lease is not None:
+                    lease.release()
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        else:
+            return call.result
+
@@ -1,7 +1,8 @@
-from urllib.request import urlopen
 from genefab3.config import COLD_GLDS_MASK, COLD_FILEURLS_MASK
 from genefab3.config import COLD_FILEDATES_MASK, TIMESTAMP_FMT
-from json import loads
+from genefab3.coldstorage.client import COLD_STORAGE_CLIENT
+from json import loads, dumps
+from hashlib import sha256
 from re import search, sub, escape
 from genefab3.exceptions import GeneLabException, GeneLabJSONException
 from datetime import datetime
@@ -25,37 +26,67 @@ def natsorted_dataframe(dataframe, by, ascending=True, sort_trailing_columns=Fal
     return ns_df.sort_values(by=by, ascending=ascending)
 
 
-def download_cold_json(identifier, kind="other"):
-    """Request and pre-parse cold storage JSONs for datasets, file listings, file dates"""
+def download_json(url, etag=None, last_modified=None):
+    """Request and parse JSON through shared cold storage client; with validators, return None if not modified"""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    with COLD_STORAGE_CLIENT.open(url, headers=headers) as response:
+        if response.status == 304:
+            raw_json = None
+        else:
+            raw_json = loads(response.read().decode())
+        response_headers = response.headers
+    validators = {
+        "etag": response_headers.get("ETag", etag),
+        "last_modified": response_headers.get("Last-Modified", last_modified),
+    }
+    return raw_json, {k: v for k, v in validators.items() if v}
+
+
+def get_cold_json_url(identifier, kind="other"):
+    """Get URL of cold storage JSON for datasets, file listings, file dates"""
     if kind == "glds":
-        url = COLD_GLDS_MASK.format(identifier)
-        with urlopen(url) as response:
-            return loads(response.read().decode())
+        return COLD_GLDS_MASK.format(identifier)
     elif kind == "fileurls":
         accession_number_match = search(r'\d+$', identifier)
         if accession_number_match:
             accession_number = accession_number_match.group()
         else:
             raise GeneLabException("Malformed accession number")
-        url = COLD_FILEURLS_MASK.format(accession_number)
-        with urlopen(url) as response:
-            raw_json = loads(response.read().decode())
-            try:
-                return raw_json["studies"][identifier]["study_files"]
-            except KeyError:
-                raise GeneLabJSONException("Malformed 'files' JSON")
+        return COLD_FILEURLS_MASK.format(accession_number)
     elif kind == "filedates":
-        url = COLD_FILEDATES_MASK.format(identifier)
-        with urlopen(url) as response:
-            return loads(response.read().decode())
+        return COLD_FILEDATES_MASK.format(identifier)
     elif kind == "other":
-        url = identifier
-        with urlopen(url) as response:
-            return loads(response.read().decode())
+        return identifier
     else:
         raise GeneLabException("Unknown JSON request: kind='{}'".format(kind))
 
 
+def download_cold_json(identifier, kind="other", validators=None):
+    """Request and pre-parse cold storage JSONs for datasets, file listings, file dates"""
+    url = get_cold_json_url(identifier, kind)
+    raw_json, new_validators = download_json(url, **(validators or {}))
+    if (kind == "fileurls") and (raw_json is not None):
+        try:
+            raw_json = raw_json["studies"][identifier]["study_files"]
+        except KeyError:
+            raise GeneLabJSONException("Malformed 'files' JSON")
+    return raw_json, new_validators
+
+
+def canonical_json(raw_json):
+    """Serialize JSON with sorted keys and no extraneous whitespace"""
+    return dumps(raw_json, sort_keys=True, separators=(",", ":"))
+
+
+def json_digest(raw_json):
+    """Hash canonical serialization of JSON"""
+    return sha256(canonical_json(raw_json).encode()).hexdigest()
+
+
 def extract_file_timestamp(fd, key="date_modified", fallback_key="date_created", fallback_value=-1, fmt=TIMESTAMP_FMT):
     """Convert date like 'Fri Oct 11 22:02:48 EDT 2019' to timestamp"""
     strdate = fd.get(key)
@@ -0,0 +1,111 @@
+from genefab3.caching import LRUCache, FileCache
+from tempfile import TemporaryDirectory
+from os import path, listdir, utime
+from unittest import TestCase, main
+
+
+class TestLRUCache(TestCase):
+ 
+    def setUp(self):
+        self.cache = LRUCache(max_entries=3, max_bytes=10, sizeof=len)
+ 
+    def test_bounded_by_entries(self):
+        for key in "abcd":
+            self.cache.put(key, "x")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(list(self.cache.entries), ["b", "c", "d"])
+        self.cache.get("b") # now most recently used
+        self.cache.put("e", "x")
+        self.assertEqual(list(self.cache.entries), ["d", "b", "e"])
+ 
+    def test_bounded_by_bytes(self):
+        self.cache.put("a", "xxxx")
+        self.cache.put("b", "xxxx")
+        self.cache.put("c", "xxxx")
+        self.assertEqual(list(self.cache.entries), ["b", "c"])
+        self.assertEqual(self.cache.stats()["bytes"], 8)
+        self.cache.put("d", "x" * 11) # never fits
+        self.assertIsNone(self.cache.get("d"))
+        self.assertEqual(self.cache.stats()["bytes"], 8)
+ 
+    def test_values_that_grew_are_remeasured(self):
+        self.cache.put("a", [1])
+        self.cache.put("b", [1])
+        value = self.cache.get("a")
+        value.extend(range(9))
+        self.assertIs(self.cache.get("a"), value)
+        self.assertEqual(list(self.cache.entries), ["a"])
+        self.assertEqual(self.cache.stats()["bytes"], 10)
+ 
+    def test_other_versions_are_misses(self):
+        self.cache.put("a", "x", version=1)
+        self.assertIsNone(self.cache.get("a", version=2))
+        self.cache.put("a", "y", version=2)
+        self.assertEqual(self.cache.get("a", version=2), "y")
+        self.assertEqual(self.cache.stats()["bytes"], 1)
+
+
+class TestFileCache(TestCase):
+ 
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.cache = FileCache(path.join(self.tempdir.name, "c"), max_bytes=10)
+        self.stored = []
+ 
+    def tearDown(self):
+        self.tempdir.cleanup()
+ 
+    def store(self, url, temp):
+        self.stored.append(url)
+        temp.write(b"1234")
+ 
+    def fetch(self, url, timestamp=0, age=0):
+        entrypath = self.cache.fetch(url, timestamp, self.store)
+        utime(entrypath, (1000 - age, 1000 - age))
+        return entrypath
+ 
+    def entries(self):
+        return sorted(f for f in listdir(self.cache.root) if f[0] != ".")
+ 
+    def test_entry_is_stored_once(self):
+        entrypath = self.fetch("a")
+        self.assertEqual(self.fetch("a"), entrypath)
+        self.assertEqual(self.stored, ["a"])
+        with open(entrypath, mode="rb") as handle:
+            self.assertEqual(handle.read(), b"1234")
+ 
+    def test_new_timestamp_replaces_entry(self):
+        old_entrypath = self.fetch("a", timestamp=1)
+        new_entrypath = self.fetch("a", timestamp=2)
+        self.assertEqual(self.stored, ["a", "a"])
+        self.assertFalse(path.exists(old_entrypath))
+        self.assertEqual(self.entries(), [path.basename(new_entrypath)])
+ 
+    def test_least_recently_used_entries_are_evicted(self):
+        a, b = self.fetch("a", age=2), self.fetch("b", age=1)
+        self.fetch("a", age=0) # now most recently used
+        c = self.fetch("c")
+        self.assertFalse(path.exists(b))
+        self.assertEqual(self.entries(), sorted(map(path.basename, [a, c])))
+ 
+    def test_pinned_entries_are_not_evicted(self):
+        with self.cache.pinned("a", 0, self.store) as a:
+            utime(a, (0, 0)) # least recently used
+            self.assertFalse(self.cache.discard(a))
+            self.fetch("b")
+            self.fetch("c")
+            self.assertTrue(path.exists(a))
+        self.assertTrue(self.cache.discard(a))
+        self.assertFalse(path.exists(a))
+ 
+    def test_failed_store_leaves_no_entry(self):
+        def store(url, temp):
+            temp.write(b"12")
+            raise OSError("interrupted")
+        with self.assertRaises(OSError):
+            self.cache.fetch("a", 0, store)
+        self.assertEqual(listdir(self.cache.root), [])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+from genefab3.coldstorage.client import ColdStorageClient, CircuitBreaker
+from genefab3.exceptions import GeneLabColdStorageException
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from socket import timeout as SocketTimeout
+from threading import Thread
+from unittest import TestCase, main
+from unittest.mock import patch
+from time import sleep
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """Serves stub responses concurrently"""
+    daemon_threads = True
+
+
+class ColdStorageStub(BaseHTTPRequestHandler):
+    """Serves '/ok', slow, flaky and dropped responses, and responses whose bodies are cut short"""
+    requests = []
+ 
+    def do_GET(self):
+        """Record path; respond with 200, truncated error or redirect body, or not at all"""
+        self.requests.append(self.path)
+        if self.path in {"/slow", "/drop"}: # close without responding
+            if self.path == "/slow":
+                sleep(1) # client times out first
+            self.close_connection = True
+            return
+        elif (self.path == "/flaky") and (self.requests.count("/flaky") == 1):
+            self.send_response(503) # transient error with complete body
+            self.send_header("Content-Length", "4")
+            self.end_headers()
+            self.wfile.write(b"busy")
+            return
+        status = {"/503": 503, "/404": 404, "/302": 302}.get(self.path, 200)
+        self.send_response(status)
+        if status == 302:
+            self.send_header("Location", "/ok")
+        if status == 200:
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+        else: # promise more than is sent, then close connection
+            self.send_header("Content-Length", "100")
+            self.end_headers()
+            self.wfile.write(b"truncated")
+        self.close_connection = True
+ 
+    def log_message(self, *args):
+        """Keep test output clean"""
+        pass
+
+
+class TestColdStorageClient(TestCase):
+ 
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ColdStorageStub)
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = "http://127.0.0.1:{}".format(cls.server.server_port)
+ 
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+ 
+    def setUp(self):
+        ColdStorageStub.requests.clear()
+        self.client = ColdStorageClient(
+            max_connections_per_host=2, timeout=.5, retries=1, backoff=0,
+            pool_timeout=1,
+        )
+ 
+    def get(self, path):
+        with self.client.open(self.url + path) as response:
+            return response.read()
+ 
+    def free_slots(self):
+        pool, = self.client.pools.values()
+        return pool.semaphore._value
+ 
+    def test_truncated_bodies_release_connections(self):
+        for path in ("/503", "/404", "/302", "/503"):
+            with self.assertRaises(Exception):
+                self.get(path)
+        self.assertEqual(self.free_slots(), 2)
+        self.assertEqual(self.get("/ok"), b"ok")
+        self.assertEqual(self.free_slots(), 2)
+ 
+    def test_waiting_for_connection_times_out(self):
+        pool = self.client.get_pool("http", self.url.split("//")[1])
+        held = [pool.acquire(), pool.acquire()]
+        with self.assertRaises(GeneLabColdStorageException):
+            self.get("/ok")
+        for connection in held:
+            pool.release(connection, reusable=False)
+        self.assertEqual(self.get("/ok"), b"ok")
+ 
+    def test_transient_errors_are_retried(self):
+        self.assertEqual(self.get("/flaky"), b"ok")
+        self.assertEqual(ColdStorageStub.requests, ["/flaky", "/flaky"])
+        with self.assertRaises(Exception):
+            self.get("/drop")
+        self.assertEqual(ColdStorageStub.requests[2:], ["/drop", "/drop"])
+        self.assertEqual(self.free_slots(), 2)
+ 
+    def test_timeouts_are_not_retried(self):
+        with self.assertRaises(SocketTimeout):
+            self.get("/slow")
+        self.assertEqual(ColdStorageStub.requests, ["/slow"])
+        self.assertEqual(self.free_slots(), 2)
+
+
+class TestCircuitBreaker(TestCase):
+ 
+    def setUp(self):
+        self.now = 1000
+        self.clock = patch(
+            "genefab3.coldstorage.client.time", lambda: self.now,
+        )
+        self.clock.start()
+        self.breaker = CircuitBreaker(threshold=3, cooldown=10, max_cooldown=35)
+ 
+    def tearDown(self):
+        self.clock.stop()
+ 
+    def trip(self):
+        while self.breaker.allow():
+            self.breaker.record_failure()
+ 
+    def test_opens_at_threshold(self):
+        for _ in range(2):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, "closed")
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, "open")
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.seconds_until_probe(), 10)
+ 
+    def test_lets_single_probe_through(self):
+        self.trip()
+        self.now += 10
+        self.assertEqual(self.breaker.state, "half-open")
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, "closed")
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+ 
+    def test_cooldown_doubles_up_to_max(self):
+        self.trip()
+        for cooldown in (20, 35, 35):
+            self.now += self.breaker.seconds_until_probe()
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+            self.assertEqual(self.breaker.state, "open")
+            self.assertEqual(self.breaker.seconds_until_probe(), cooldown)
+
+
+if __name__ == "__main__":
+    main()
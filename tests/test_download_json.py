@@ -0,0 +1,99 @@
+from genefab3.utils import download_json, download_cold_json
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from json import dumps
+from unittest import TestCase, main
+
+
+ETAG, LAST_MODIFIED = '"v1"', "Wed, 21 Oct 2015 07:28:00 GMT"
+BODY = {"studies": {"GLDS-1": {"study_files": [{"file_name": "a.csv"}]}}}
+
+
+class ColdStorageStub(BaseHTTPRequestHandler):
+    """Serves BODY with validators; answers 304 to matching conditional requests"""
+    requests = []
+ 
+    def do_GET(self):
+        """Record request headers, respond with 200 or 304"""
+        self.requests.append(dict(self.headers))
+        not_modified = (
+            (self.headers.get("If-None-Match") == ETAG) or
+            (self.headers.get("If-Modified-Since") == LAST_MODIFIED)
+        )
+        payload = b"" if not_modified else dumps(BODY).encode()
+        self.send_response(304 if not_modified else 200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        if not not_modified:
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+ 
+    def log_message(self, *args):
+        """Keep test output clean"""
+        pass
+
+
+class TestDownloadJSON(TestCase):
+ 
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), ColdStorageStub)
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = "http://127.0.0.1:{}/".format(cls.server.server_port)
+ 
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+ 
+    def setUp(self):
+        ColdStorageStub.requests.clear()
+ 
+    def test_unconditional_request_returns_json_and_validators(self):
+        raw_json, validators = download_json(self.url)
+        self.assertEqual(raw_json, BODY)
+        self.assertEqual(validators, {
+            "etag": ETAG, "last_modified": LAST_MODIFIED,
+        })
+        self.assertNotIn("If-None-Match", ColdStorageStub.requests[-1])
+ 
+    def test_etag_not_modified(self):
+        raw_json, validators = download_json(self.url, etag=ETAG)
+        self.assertIsNone(raw_json)
+        self.assertEqual(validators["etag"], ETAG)
+        self.assertEqual(ColdStorageStub.requests[-1]["If-None-Match"], ETAG)
+ 
+    def test_last_modified_not_modified(self):
+        raw_json, validators = download_json(
+            self.url, last_modified=LAST_MODIFIED,
+        )
+        self.assertIsNone(raw_json)
+        self.assertEqual(validators["last_modified"], LAST_MODIFIED)
+        self.assertEqual(
+            ColdStorageStub.requests[-1]["If-Modified-Since"], LAST_MODIFIED,
+        )
+ 
+    def test_stale_validators_get_full_response(self):
+        raw_json, validators = download_json(
+            self.url, etag='"v0"', last_modified="Thu, 01 Jan 1970 00:00:00 GMT",
+        )
+        self.assertEqual(raw_json, BODY)
+        self.assertEqual(validators, {
+            "etag": ETAG, "last_modified": LAST_MODIFIED,
+        })
+ 
+    def test_cold_json_always_returns_pair(self):
+        for validators in (None, {}, {"etag": '"v0"'}):
+            raw_json, new_validators = download_cold_json(
+                self.url, validators=validators,
+            )
+            self.assertEqual(raw_json, BODY)
+            self.assertEqual(new_validators["etag"], ETAG)
+        raw_json, _ = download_cold_json(self.url, validators={"etag": ETAG})
+        self.assertIsNone(raw_json)
+
+
+if __name__ == "__main__":
+    main()
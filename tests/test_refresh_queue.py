@@ -0,0 +1,67 @@
+from unittest import TestCase, main, skipIf
+try:
+    from mongomock import MongoClient
+    from genefab3.mongo.refresh_queue import enqueue_refresh, claim_refresh
+    from genefab3.mongo.refresh_queue import complete_refresh, release_refresh
+    from genefab3.mongo.refresh_queue import has_pending_refreshes
+except ImportError: # mongomock or pymongo not installed
+    MongoClient = None
+
+
+@skipIf(MongoClient is None, "mongomock is not installed")
+class TestRefreshQueue(TestCase):
+ 
+    def setUp(self):
+        self.db = MongoClient().db
+ 
+    def test_completed_entry_leaves_queue(self):
+        enqueue_refresh(self.db, "GLDS-1")
+        entry = claim_refresh(self.db, "worker")
+        self.assertEqual(entry["accession"], "GLDS-1")
+        self.assertFalse(has_pending_refreshes(self.db))
+        self.assertIsNone(claim_refresh(self.db, "other worker"))
+        complete_refresh(self.db, entry)
+        self.assertEqual(self.db.refresh_queue.count_documents({}), 0)
+ 
+    def test_entry_enqueued_in_flight_is_returned_to_queue(self):
+        enqueue_refresh(self.db, "GLDS-1")
+        entry = claim_refresh(self.db, "worker")
+        enqueue_refresh(self.db, "GLDS-1", on_demand=True)
+        complete_refresh(self.db, entry)
+        self.assertTrue(has_pending_refreshes(self.db))
+        reclaimed = claim_refresh(self.db, "worker")
+        self.assertEqual(reclaimed["generation"], entry["generation"] + 1)
+        self.assertTrue(reclaimed["force"])
+        complete_refresh(self.db, reclaimed)
+        self.assertEqual(self.db.refresh_queue.count_documents({}), 0)
+ 
+    def test_released_entry_can_be_claimed_again(self):
+        enqueue_refresh(self.db, "GLDS-1")
+        entry = claim_refresh(self.db, "worker")
+        release_refresh(self.db, entry)
+        reclaimed = claim_refresh(self.db, "other worker")
+        self.assertEqual(reclaimed["generation"], entry["generation"])
+        self.assertEqual(reclaimed["claimed_by"], "other worker")
+        release_refresh(self.db, entry) # stale claimant changes nothing
+        self.assertFalse(has_pending_refreshes(self.db))
+ 
+    def test_abandoned_claims_expire(self):
+        enqueue_refresh(self.db, "GLDS-1")
+        claim_refresh(self.db, "crashed worker")
+        self.assertTrue(has_pending_refreshes(self.db, claim_timeout=-1))
+        entry = claim_refresh(self.db, "worker", claim_timeout=-1)
+        self.assertEqual(entry["claimed_by"], "worker")
+ 
+    def test_on_demand_entries_are_claimed_first(self):
+        enqueue_refresh(self.db, "GLDS-1", last_refreshed=1)
+        enqueue_refresh(self.db, "GLDS-2", last_refreshed=2)
+        enqueue_refresh(self.db, "GLDS-3", on_demand=True, last_refreshed=3)
+        claimed = [claim_refresh(self.db, "worker") for _ in range(3)]
+        self.assertEqual(
+            [entry["accession"] for entry in claimed],
+            ["GLDS-3", "GLDS-1", "GLDS-2"],
+        )
+
+
+if __name__ == "__main__":
+    main()